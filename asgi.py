@@ -0,0 +1,22 @@
+#! /usr/bin/env python3
+#
+################
+#
+# asgi.py
+#
+################
+#
+
+"""
+    ASGI entry point, e.g. ``uvicorn asgi:application``.
+"""
+
+from project import app
+from project.asgi import ASGIAdapter
+
+application = ASGIAdapter(
+    app,
+    api_threads=app.config["ASGI_API_THREADS"],
+    html_threads=app.config["ASGI_HTML_THREADS"],
+    stream_threads=app.config["ASGI_STREAM_THREADS"],
+)
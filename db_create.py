@@ -13,10 +13,14 @@
 
 
 from project import db
+from project.migrations import stamp
 
 # create the database and the db table
 db.create_all()
 
+# the tables are already current, so no migration needs to run on them
+stamp(db.engine)
+
 # insert data
 # db.session.add(Task("Finish this tutorial", date(2016, 9, 22), 10, 1))
 # db.session.add(Task("Finish Real Python", date(2016, 10, 3), 10, 1))
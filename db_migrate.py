@@ -8,42 +8,19 @@
 #
 
 """
-    Update Task table.
+    Bring the database schema up to date.
+
+    Same as ``flask db-upgrade``; see project/migrations.py for the
+    migrations themselves.
 """
 
-from views import db
-from _config import DATABASE_PATH
-import sqlite3
-from datetime import datetime
+from project import db
+from project.migrations import upgrade
+
+
+def progress(table, copied):
+    print(f"  {table}: {copied} rows copied")
 
-# with sqlite3.connect(DATABASE_PATH) as connection:
-#     c = connection.cursor()
-#     c.execute("""ALTER TABLE tasks RENAME TO old_tasks""")
-#     db.create_all()
-#     c.execute(
-#         """SELECT name, due_date, priority, status
-#            FROM old_tasks ORDER by task_id ASC"""
-#     )
-#     data = [
-#         (row[0], row[1], row[2], row[3], datetime.now(), 1)
-#         for row in c.fetchall()
-#     ]
-#     c.executemany(
-#         """INSERT INTO tasks
-#             (name, due_date, priority, status, posted_date, user_id)
-#             VALUES (?, ?, ?, ?, ?, ?)""",
-#         data,
-#     )
-#     c.execute("""DROP TABLE old_tasks""")
 
-with sqlite3.connect(DATABASE_PATH) as connection:
-    c = connection.cursor()
-    c.execute("""ALTER TABLE users RENAME to old_users""")
-    db.create_all()
-    c.execute("""SELECT name, email, password FROM old_users ORDER BY id ASC""")
-    data = [(row[0], row[1], row[2], "user") for row in c.fetchall()]
-    c.executemany(
-        """INSERT INTO users (name, email,password, role) VALUES (?, ?, ?, ?)""",
-        data,
-    )
-    c.execute("""DROP TABLE old_users""")
+for revision in upgrade(db.engine, progress=progress):
+    print(f"applied {revision}")
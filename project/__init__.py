@@ -13,14 +13,25 @@ docstring goes here.  be sure to write a good one ;)
 
 import datetime
 from flask import Flask, render_template, request
-from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
+from project import assets, migrations, templating
+from project.cache import ResponseCache
+from project.database import SQLAlchemy
+from project.events import Events
+from project.passwords import PasswordHasher
 
 app = Flask(__name__)
 app.config.from_pyfile("_config.py")
 bcrypt = Bcrypt(app)
+passwords = PasswordHasher(app)
 db = SQLAlchemy(app)
+cache = ResponseCache(app)
+events = Events(app)
+assets.init_app(app)
+migrations.init_app(app, db)
+templating.init_app(app)
 
+from project import archive, counters, imports, search, tokens
 from project.users.views import users_blueprint
 from project.tasks.views import tasks_blueprint
 from project.api.views import api_blueprint
@@ -29,6 +40,15 @@ from project.api.views import api_blueprint
 app.register_blueprint(users_blueprint)
 app.register_blueprint(tasks_blueprint)
 app.register_blueprint(api_blueprint)
+archive.init_app(app, db)
+counters.init_app(app, db)
+imports.init_app(app, db)
+search.init_app(app, db)
+tokens.init_app(app, db)
+
+# compile the templates now rather than on each worker's first request
+if app.config["TEMPLATE_PRECOMPILE"]:
+    templating.precompile(app)
 
 
 @app.errorhandler(404)
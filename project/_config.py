@@ -27,3 +27,94 @@ SECRET_KEY = (
 DATABASE_PATH = os.path.join(basedir, DATABASE)
 SQLALCHEMY_DATABASE_URI = "sqlite:///" + DATABASE_PATH
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# connection pool for the file database: connections kept open, extra ones
+# allowed under load, and how long a request waits for one
+SQLALCHEMY_POOL_SIZE = 5
+SQLALCHEMY_MAX_OVERFLOW = 10
+SQLALCHEMY_POOL_TIMEOUT = 30
+
+# read replicas for plain SELECTs; after writing, a session and its browser
+# keep reading from the primary for this many seconds
+SQLALCHEMY_REPLICA_URIS = []
+SQLALCHEMY_REPLICA_STICKY_SECONDS = 5
+
+# pragmas set on every new SQLite connection (None leaves the default):
+# WAL so readers never wait for writers, NORMAL sync (safe with WAL), a
+# 5s wait for the write lock, 64MB of page cache and 256MB memory mapped
+SQLITE_JOURNAL_MODE = "wal"
+SQLITE_SYNCHRONOUS = "normal"
+SQLITE_BUSY_TIMEOUT = 5000
+SQLITE_CACHE_SIZE = -64000
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+
+# password hashing: bcrypt work factor, hashes running at once across
+# every worker on the host (None for one per CPU), how many seconds a
+# request waits for one of those slots before a 503, and where the slots'
+# lock files live; each copy of the app on the host keeps its own
+BCRYPT_LOG_ROUNDS = 12
+PASSWORD_CONCURRENCY = None
+PASSWORD_WAIT = 1
+PASSWORD_LOCK_DIR = os.path.join(basedir, ".password_slots")
+
+# users per transaction for flask users-import
+IMPORT_BATCH_SIZE = 500
+
+# api paging
+API_PAGE_SIZE = 10
+API_MAX_PAGE_SIZE = 100
+API_EXPORT_BATCH_SIZE = 1000
+API_BULK_MAX_OPERATIONS = 500
+
+# logged in users are looked up again after this many seconds
+AUTH_USER_CACHE_SIZE = 1024
+AUTH_USER_CACHE_TTL = 5
+
+# api tokens: how many verified tokens each worker remembers, and for how
+# long; a revoked token can outlive revocation in other workers this long
+API_TOKEN_CACHE_SIZE = 1024
+API_TOKEN_CACHE_TTL = 60
+
+# api response cache
+API_CACHE_BACKEND = "project.cache.lru_backend"
+API_CACHE_SIZE = 1024
+API_CACHE_TTL = 30
+
+# asgi thread pools
+ASGI_API_THREADS = 32
+ASGI_HTML_THREADS = 4
+# event streams; a couple more than EVENTS_MAX_STREAMS so the 204s for
+# streams over the limit go out without waiting
+ASGI_STREAM_THREADS = 10
+
+# compression and static files
+COMPRESS_MIN_SIZE = 500
+COMPRESS_LEVEL = 6
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+# tasks dashboard
+TASKS_PAGE_SIZE = 25
+FRAGMENT_CACHE_SIZE = 256
+FRAGMENT_CACHE_TTL = 300
+# overdue counts, kept until the next tasks write or the next day
+COUNTS_CACHE_SIZE = 1024
+COUNTS_CACHE_TTL = 24 * 60 * 60
+
+# closed tasks older than this many days move to tasks_archive
+ARCHIVE_AFTER_DAYS = 90
+ARCHIVE_BATCH_SIZE = 500
+
+# live updates
+EVENTS_BACKEND = "project.events.local_backend"
+EVENTS_QUEUE_SIZE = 100
+EVENTS_KEEPALIVE = 15
+EVENTS_STREAM_TIMEOUT = 300
+# each open stream holds a thread; keep this below the server's threads
+# (gunicorn --worker-class gthread --threads 16, see the Procfile)
+EVENTS_MAX_STREAMS = 8
+
+# compiled templates, shared by every worker on the host; the Procfile
+# fills it with flask templates-compile before starting gunicorn, so it is
+# not done at every import
+TEMPLATE_CACHE_DIR = os.path.join(basedir, ".template_cache")
+TEMPLATE_PRECOMPILE = False
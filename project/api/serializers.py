@@ -0,0 +1,66 @@
+#! /usr/bin/env python3
+#
+################
+#
+# api/serializers.py
+#
+################
+#
+
+"""
+    Task serialization for the api blueprint.
+
+    Queries built with ``task_rows`` select only the columns the API
+    exposes, so SQLAlchemy hands back plain row tuples instead of tracked
+    ``Task`` instances, and ``json_response`` encodes them straight into a
+    compact response body.
+"""
+
+import json
+from flask import Response
+from project import db
+from project.models import Task
+
+TASK_FIELDS = (
+    ("task_id", Task.task_id),
+    ("task name", Task.name),
+    ("due date", Task.due_date),
+    ("priority", Task.priority),
+    ("posted date", Task.posted_date),
+    ("status", Task.status),
+    ("user id", Task.user_id),
+)
+
+TASK_KEYS = tuple(key for key, _ in TASK_FIELDS)
+
+
+def task_rows(model=Task):
+    """
+    A query over the API's task columns, yielding plain rows.
+
+    ``model`` may be ArchivedTask, which has the same columns.
+    """
+    return db.session.query(
+        *[getattr(model, column.key) for _, column in TASK_FIELDS]
+    )
+
+
+def task_to_dict(row):
+    task_id, name, due_date, priority, posted_date, status, user_id = row
+    return {
+        "task_id": task_id,
+        "task name": name,
+        "due date": str(due_date),
+        "priority": priority,
+        "posted date": str(posted_date),
+        "status": status,
+        "user id": user_id,
+    }
+
+
+def dumps(data):
+    return json.dumps(data, separators=(",", ":"))
+
+
+def json_response(data, code=200):
+    return Response(dumps(data), status=code, mimetype="application/json")
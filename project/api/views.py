@@ -11,37 +11,71 @@
 docstring goes here.  be sure to write a good one ;)
 """
 
+import base64
+import csv
+import datetime
+import hashlib
+import heapq
+import io
+import json
 from functools import wraps
+from sqlalchemy import bindparam, tuple_
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.expression import UnaryExpression
+from sqlalchemy.orm import joinedload
 from flask import (
-    flash,
-    redirect,
-    jsonify,
-    session,
-    url_for,
+    request,
     Blueprint,
     make_response,
+    Response,
+    stream_with_context,
+)
+from project import app, cache, db, events
+from project.auth import (
+    current_user,
+    is_admin,
+    roles_required,
+    unauthorized,
+)
+from project.changes import (
+    current_version,
+    mark_tasks_changed,
+    on_tasks_changed,
+)
+from project.counters import task_counts
+from project.models import ArchivedTask, Task
+from project.search import search_tasks
+from .serializers import (
+    TASK_KEYS,
+    dumps,
+    json_response,
+    task_rows,
+    task_to_dict,
 )
-from project import db
-from project.models import Task
 
 api_blueprint = Blueprint("api", __name__)
 
+# cached api responses are only good until the next committed tasks write
+on_tasks_changed(cache.clear)
 
-def login_required(f):
-    @wraps(f)
-    def wrap(*args, **kwargs):
-        if "logged_in" in session:
-            return f(*args, **kwargs)
-        else:
-            flash("You need to login first.")
-            return redirect(url_for("users.login"))
 
-    return wrap
+@cache.versioned_by
+def tasks_version():
+    version, _ = current_version()
+    return version
+
+
+@api_blueprint.before_request
+def authenticate():
+    """Every API route needs a bearer token or a logged in user."""
+    if current_user() is None:
+        return unauthorized()
 
 
 def open_tasks():
     return (
         db.session.query(Task)
+        .options(joinedload(Task.poster))
         .filter_by(status="1")
         .order_by(Task.due_date.asc())
     )
@@ -50,44 +84,524 @@ def open_tasks():
 def closed_tasks():
     return (
         db.session.query(Task)
+        .options(joinedload(Task.poster))
         .filter_by(status="0")
         .order_by(Task.due_date.asc())
     )
 
 
+def conditional_get(f):
+    """
+    Answer conditional GETs from the tasks version counter.
+
+    The ETag is derived from the counter and the request path, so a client
+    that already has the current representation gets a bare 304 after a
+    single-row lookup, before the view runs or any task is loaded.
+
+    Last-Modified only has one-second precision, so it is left off while
+    the last write is still in the current second: a later write in that
+    same second would not change it, and If-Modified-Since would then
+    answer 304 for a stale copy.
+    """
+
+    @wraps(f)
+    def wrap(*args, **kwargs):
+        version, modified = current_version()
+        now = datetime.datetime.utcnow().replace(microsecond=0)
+        if modified and modified >= now:
+            modified = None
+        etag = hashlib.sha1(
+            f"{version}:{request.full_path}".encode("utf-8")
+        ).hexdigest()
+        if request.if_none_match:
+            fresh = request.if_none_match.contains_weak(etag)
+        elif request.if_modified_since and modified:
+            since = request.if_modified_since.replace(tzinfo=None)
+            fresh = modified <= since
+        else:
+            fresh = False
+        if fresh:
+            response = Response(status=304)
+        else:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        if modified:
+            response.last_modified = modified
+        return response
+
+    return wrap
+
+
+def encode_cursor(values):
+    """Pack the sort key of the last row on a page into an opaque token."""
+    raw = dumps(values).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token):
+    """Unpack a token made by encode_cursor, raising ValueError if bad."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw.decode("utf-8"))
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def page_size():
+    """Read the requested page size, clamped to API_MAX_PAGE_SIZE."""
+    limit = request.args.get("limit", app.config["API_PAGE_SIZE"], type=int)
+    if limit is None or limit < 1:
+        raise ValueError("limit must be a positive integer")
+    return min(limit, app.config["API_MAX_PAGE_SIZE"])
+
+
+def parse_date(value, name):
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be YYYY-MM-DD")
+
+
+# sort keys for the task list; task_id breaks ties so the order is total
+SORT_KEYS = {
+    "task_id": ("task_id",),
+    "due_date": ("due_date", "task_id"),
+    "priority": ("priority", "task_id"),
+}
+
+
+def task_models(args):
+    """
+    The tables a task list reads: archived tasks are all closed, so a
+    status filter for open tasks leaves the archive out.
+    """
+    if args.get("status", type=int) not in (None, 0):
+        return (Task,)
+    return (Task, ArchivedTask)
+
+
+def unindexed(column):
+    """``+column``, which SQLite compares without looking at its indexes."""
+    return UnaryExpression(
+        column, operator=operators.custom_op("+"), type_=column.type
+    )
+
+
+def filter_tasks(query, args, model=Task):
+    """
+    Apply the list filters from the query string.
+
+    status, priority and user_id are equality filters and due_after /
+    due_before bound due_date inclusively.  Every combination of equality
+    filters and sort key has an index that starts with the filtered
+    columns and ends in the sort key (see Task.__table_args__), so a page
+    is read in order and stops after ``limit`` rows.  Unless the list is
+    sorted by due_date, the due_date bounds are checked row by row on that
+    index rather than used to pick a due_date index, which would mean
+    sorting every matching row for each page.
+    """
+    for name in ("status", "priority", "user_id"):
+        if name in args:
+            value = args.get(name, type=int)
+            if value is None:
+                raise ValueError(f"{name} must be an integer")
+            query = query.filter(getattr(model, name) == value)
+    due_date = model.due_date
+    if args.get("sort", "task_id").lstrip("-") != "due_date":
+        due_date = unindexed(due_date)
+    if "due_after" in args:
+        query = query.filter(
+            due_date >= parse_date(args["due_after"], "due_after")
+        )
+    if "due_before" in args:
+        query = query.filter(
+            due_date <= parse_date(args["due_before"], "due_before")
+        )
+    return query
+
+
+def sort_tasks(query, args, model=Task):
+    """
+    Order the query by the ``sort`` argument and resume it from ``cursor``.
+
+    A leading ``-`` sorts descending.  Returns the query and the sort
+    columns, whose values on the last row make up the next cursor.  A sort
+    column that a filter holds constant is left out, so the cursor only
+    ranges over the columns that vary.
+    """
+    sort = args.get("sort", "task_id")
+    descending = sort.startswith("-")
+    keys = SORT_KEYS.get(sort.lstrip("-"))
+    if keys is None:
+        raise ValueError("Unknown sort key")
+    columns = tuple(getattr(model, key) for key in keys if key not in args)
+    cursor = args.get("cursor")
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(columns):
+            raise ValueError("Invalid cursor")
+        for i, column in enumerate(columns):
+            if column.key == "due_date":
+                values[i] = parse_date(values[i], "cursor")
+            elif not isinstance(values[i], int):
+                raise ValueError("Invalid cursor")
+        if len(columns) == 1:
+            key, value = columns[0], values[0]
+        else:
+            key, value = tuple_(*columns), tuple_(*values)
+        query = query.filter(key < value if descending else key > value)
+    return (
+        query.order_by(
+            *[c.desc() if descending else c.asc() for c in columns]
+        ),
+        columns,
+    )
+
+
 @api_blueprint.route("/api/v1/tasks")
+@cache.cached
+@conditional_get
 def api_tasks():
-    results = db.session.query(Task).limit(10).offset(0).all()
-    json_results = []
-    for result in results:
-        data = {
-            "task_id": result.task_id,
-            "task name": result.name,
-            "due date": str(result.due_date),
-            "priority": result.priority,
-            "posted date": str(result.posted_date),
-            "status": result.status,
-            "user id": result.user_id,
-        }
-        json_results.append(data)
-    return jsonify(item=json_results)
+    """
+    One page of tasks, filtered and sorted by the query string.
+
+    Paging is keyset based: the ``next`` cursor holds the sort key of the
+    last row of the page and the following page starts strictly after it,
+    so every page is an index range scan no matter how deep the client
+    goes.  The archive is read the same way and merged in, as on the
+    dashboard.
+    """
+    try:
+        limit = page_size()
+        queries = [
+            sort_tasks(
+                filter_tasks(task_rows(model), request.args, model),
+                request.args,
+                model,
+            )
+            for model in task_models(request.args)
+        ]
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+    results = []
+    for query, columns in queries:
+        results.extend(query.limit(limit + 1).all())
+    results.sort(
+        key=lambda row: [getattr(row, c.key) for c in columns],
+        reverse=request.args.get("sort", "").startswith("-"),
+    )
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        last = results[-1]
+        next_cursor = encode_cursor(
+            [
+                str(value) if isinstance(value, datetime.date) else value
+                for value in (getattr(last, c.key) for c in columns)
+            ]
+        )
+    json_results = [task_to_dict(result) for result in results]
+    return json_response({"item": json_results, "next": next_cursor})
+
+
+@api_blueprint.route("/api/v1/tasks/search")
+@cache.cached
+@conditional_get
+def search():
+    """
+    Tasks whose name matches ``q``, best match first.
+
+    The list filters apply as well.  Pages are numbered rather than keyed:
+    FTS5 has to score every match to rank them anyway, so a cursor would
+    not save any work here.
+    """
+    try:
+        limit = page_size()
+        page = request.args.get("page", 1, type=int)
+        if page is None or page < 1:
+            raise ValueError("page must be a positive integer")
+        query = filter_tasks(task_rows(), request.args)
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+    query = search_tasks(query, request.args.get("q", ""))
+    if query is None:
+        return json_response({"error": "q is required"}, 400)
+    results = query.offset((page - 1) * limit).limit(limit + 1).all()
+    next_page = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_page = page + 1
+    json_results = [task_to_dict(result) for result in results]
+    return json_response({"item": json_results, "next": next_page})
 
 
 @api_blueprint.route("/api/v1/tasks/<int:task_id>")
+@cache.cached
+@conditional_get
 def task(task_id):
-    result = db.session.query(Task).filter_by(task_id=task_id).first()
+    result = task_rows().filter(Task.task_id == task_id).first()
+    if result is None:
+        result = (
+            task_rows(ArchivedTask)
+            .filter(ArchivedTask.task_id == task_id)
+            .first()
+        )
     if result:
-        json_result = {
-            "task_id": result.task_id,
-            "task name": result.name,
-            "due date": str(result.due_date),
-            "priority": result.priority,
-            "posted date": str(result.posted_date),
-            "status": result.status,
-            "user id": result.user_id,
-        }
+        json_result = task_to_dict(result)
         code = 200
     else:
         json_result = {"error": "Element does not exist"}
         code = 404
-    return make_response(jsonify(json_result), code)
+    return json_response(json_result, code)
+
+
+def export_rows():
+    """
+    Yield every task as a plain row.
+
+    Rows are pulled from streaming cursors over the tasks and the archive
+    in batches of API_EXPORT_BATCH_SIZE and merged in task_id order, so at
+    most one batch of each is held in memory.
+    """
+    queries = [
+        task_rows(model)
+        .order_by(model.task_id.asc())
+        .execution_options(stream_results=True)
+        .yield_per(app.config["API_EXPORT_BATCH_SIZE"])
+        for model in (Task, ArchivedTask)
+    ]
+    for row in heapq.merge(*queries, key=lambda row: row.task_id):
+        yield row
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield dumps(task_to_dict(row)) + "\n"
+
+
+def csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(TASK_KEYS)
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+EXPORT_FORMATS = {
+    "ndjson": (ndjson_lines, "application/x-ndjson"),
+    "csv": (csv_lines, "text/csv"),
+}
+
+
+@api_blueprint.route("/api/v1/tasks/export")
+def export_tasks():
+    """Stream every task as NDJSON (the default) or CSV."""
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in EXPORT_FORMATS:
+        json_result = {"error": "Unknown export format"}
+        return json_response(json_result, 400)
+    encode, mimetype = EXPORT_FORMATS[fmt]
+    response = Response(
+        stream_with_context(encode(export_rows())), mimetype=mimetype
+    )
+    response.headers["Content-Disposition"] = (
+        f"attachment; filename=tasks.{fmt}"
+    )
+    return response
+
+
+BULK_FIELDS = ("name", "due_date", "priority")
+
+
+def parse_operation(op):
+    """Validate one bulk operation and return it in normalised form."""
+    if not isinstance(op, dict):
+        raise ValueError("Operation must be an object")
+    kind = op.get("op")
+    if kind not in ("create", "update", "complete", "delete"):
+        raise ValueError("Unknown operation")
+    parsed = {"op": kind}
+    if kind != "create":
+        task_id = op.get("task_id")
+        if not isinstance(task_id, int) or isinstance(task_id, bool):
+            raise ValueError("task_id must be an integer")
+        parsed["task_id"] = task_id
+    if kind in ("create", "update"):
+        for field in BULK_FIELDS:
+            if field not in op:
+                if kind == "create":
+                    raise ValueError(f"{field} is required")
+                continue
+            value = op[field]
+            if field == "name":
+                if not isinstance(value, str) or not value.strip():
+                    raise ValueError("name must be a non-empty string")
+            elif field == "due_date":
+                value = parse_date(value, "due_date")
+            elif field == "priority":
+                if (
+                    not isinstance(value, int)
+                    or isinstance(value, bool)
+                    or not 1 <= value <= 10
+                ):
+                    raise ValueError("priority must be between 1 and 10")
+            parsed[field] = value
+        if kind == "update" and len(parsed) == 2:
+            raise ValueError("Nothing to update")
+    return parsed
+
+
+@api_blueprint.route("/api/v1/tasks/bulk", methods=["POST"])
+def bulk_tasks():
+    """
+    Apply many task creates, updates, completes and deletes at once.
+
+    The request is all or nothing.  Ownership of every referenced task is
+    checked with a single query, each kind of write is sent as one batched
+    statement, and the whole request is committed once.  Writes are grouped
+    by kind rather than applied in request order, so a task may appear in
+    only one operation.  The counts in the answer are the rows each
+    statement changed, which leaves out tasks deleted by another request
+    after the ownership check.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        payload = {}
+    operations = payload.get("operations")
+    if not isinstance(operations, list) or not operations:
+        json_result = {"error": "operations must be a non-empty list"}
+        return json_response(json_result, 400)
+    if len(operations) > app.config["API_BULK_MAX_OPERATIONS"]:
+        json_result = {"error": "Too many operations"}
+        return json_response(json_result, 400)
+
+    parsed, errors = [], []
+    seen = set()
+    for index, op in enumerate(operations):
+        try:
+            op = parse_operation(op)
+        except ValueError as e:
+            errors.append({"index": index, "error": str(e)})
+            continue
+        if op.get("task_id") in seen:
+            errors.append(
+                {"index": index, "error": "Only one operation per task"}
+            )
+        elif "task_id" in op:
+            seen.add(op["task_id"])
+        parsed.append(op)
+    if errors:
+        return json_response({"errors": errors}, 400)
+
+    task_ids = {op["task_id"] for op in parsed if "task_id" in op}
+    owners = {}
+    if task_ids:
+        owners = dict(
+            db.session.query(Task.task_id, Task.user_id).filter(
+                Task.task_id.in_(task_ids)
+            )
+        )
+    user = current_user()
+    admin = is_admin()
+    for index, op in enumerate(parsed):
+        if "task_id" not in op:
+            continue
+        if op["task_id"] not in owners:
+            errors.append({"index": index, "error": "Element does not exist"})
+        elif not admin and owners[op["task_id"]] != user.id:
+            errors.append(
+                {
+                    "index": index,
+                    "error": "You can only modify tasks that belong to you.",
+                }
+            )
+    if errors:
+        return json_response({"errors": errors}, 403)
+
+    table = Task.__table__
+    today = datetime.datetime.utcnow().date()
+    creates = [
+        {
+            "name": op["name"],
+            "due_date": op["due_date"],
+            "priority": op["priority"],
+            "posted_date": today,
+            "status": 1,
+            "user_id": user.id,
+        }
+        for op in parsed
+        if op["op"] == "create"
+    ]
+    updates = {}
+    for op in parsed:
+        if op["op"] == "update":
+            fields = tuple(f for f in BULK_FIELDS if f in op)
+            params = {f"new_{f}": op[f] for f in fields}
+            params["target_id"] = op["task_id"]
+            updates.setdefault(fields, []).append(params)
+    completes = [op["task_id"] for op in parsed if op["op"] == "complete"]
+    deletes = [op["task_id"] for op in parsed if op["op"] == "delete"]
+
+    json_result = dict.fromkeys(
+        ("created", "updated", "completed", "deleted"), 0
+    )
+    if creates:
+        result = db.session.execute(table.insert(), creates)
+        json_result["created"] = result.rowcount
+    for fields, params in updates.items():
+        result = db.session.execute(
+            table.update()
+            .where(table.c.task_id == bindparam("target_id"))
+            .values({f: bindparam(f"new_{f}") for f in fields}),
+            params,
+        )
+        json_result["updated"] += result.rowcount
+    if completes:
+        result = db.session.execute(
+            table.update()
+            .where(table.c.task_id.in_(completes))
+            .values(status=0)
+        )
+        json_result["completed"] = result.rowcount
+    if deletes:
+        result = db.session.execute(
+            table.delete().where(table.c.task_id.in_(deletes))
+        )
+        json_result["deleted"] = result.rowcount
+    mark_tasks_changed(db.session)
+    db.session.commit()
+    # executemany does not report the new ids, so dashboards are only told
+    # that tasks were added and refresh their first page
+    if creates:
+        events.publish("tasks", "added", task_ids=None)
+    updated = [
+        params["target_id"] for batch in updates.values() for params in batch
+    ]
+    for event, task_ids in (
+        ("updated", updated),
+        ("completed", completes),
+        ("deleted", deletes),
+    ):
+        if task_ids:
+            events.publish("tasks", event, task_ids=task_ids)
+    return json_response(json_result)
+
+
+@api_blueprint.route("/api/v1/users/<int:user_id>/counts")
+def user_task_counts(user_id):
+    """Open, closed and overdue task counts, read from task_counts."""
+    return json_response(task_counts(user_id))
+
+
+@api_blueprint.route("/api/v1/cache/stats")
+@roles_required("admin")
+def cache_stats():
+    return json_response(cache.stats())
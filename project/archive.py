@@ -0,0 +1,99 @@
+#! /usr/bin/env python3
+#
+################
+#
+# project/archive.py
+#
+################
+#
+
+"""
+    Archive tier for closed tasks.
+
+    Closed tasks past ARCHIVE_AFTER_DAYS move from ``tasks`` to
+    ``tasks_archive`` in batches, keeping the hot table (and every index
+    the dashboard and API scan) down to the tasks people still work on.
+    Archived tasks keep their ids and stay readable.
+"""
+
+import datetime
+import click
+from sqlalchemy import and_, literal, select
+from project import db
+from project.models import ArchivedTask, Task
+
+ARCHIVE_COLUMNS = (
+    "task_id",
+    "name",
+    "due_date",
+    "priority",
+    "posted_date",
+    "status",
+    "user_id",
+)
+
+
+def archive_tasks(before, batch_size=500, progress=None):
+    """
+    Move closed tasks due before ``before`` to the archive.
+
+    Each batch is one transaction, so writers are only held up for a batch
+    at a time.  The copy and the delete both re-check ``status``, and both
+    run under the batch's write lock, so a task reopened meanwhile stays
+    put.  Returns the number of tasks archived.
+    """
+    archived = 0
+    while True:
+        task_ids = [
+            row.task_id
+            for row in db.session.query(Task.task_id)
+            .filter(Task.status == 0, Task.due_date < before)
+            .order_by(Task.task_id)
+            .limit(batch_size)
+        ]
+        if not task_ids:
+            break
+        batch = and_(Task.task_id.in_(task_ids), Task.status == 0)
+        now = datetime.datetime.utcnow()
+        db.session.execute(
+            ArchivedTask.__table__.insert().from_select(
+                ARCHIVE_COLUMNS + ("archived_date",),
+                select(
+                    [getattr(Task, name) for name in ARCHIVE_COLUMNS]
+                    + [literal(now)]
+                ).where(batch),
+            )
+        )
+        moved = (
+            db.session.query(Task)
+            .filter(batch)
+            .delete(synchronize_session=False)
+        )
+        db.session.commit()
+        archived += moved
+        if progress:
+            progress(archived)
+    return archived
+
+
+def init_app(app, db):
+    @app.cli.command("tasks-archive")
+    @click.option(
+        "--days",
+        default=app.config["ARCHIVE_AFTER_DAYS"],
+        help="Archive closed tasks due more than this many days ago.",
+    )
+    @click.option(
+        "--batch-size",
+        default=app.config["ARCHIVE_BATCH_SIZE"],
+        help="Tasks moved per transaction.",
+    )
+    def tasks_archive(days, batch_size):
+        """Move old closed tasks to the archive table."""
+        before = datetime.date.today() - datetime.timedelta(days=days)
+        total = archive_tasks(
+            before,
+            batch_size,
+            progress=lambda n: click.echo(f"  {n} tasks archived"),
+        )
+        click.echo(f"archived {total} tasks due before {before}")
@@ -0,0 +1,218 @@
+#! /usr/bin/env python3
+#
+################
+#
+# project/asgi.py
+#
+################
+#
+
+"""
+    ASGI front end for the taskr app.
+
+    Requests are accepted on the event loop and the blocking work (the
+    Flask view and its SQLite queries) runs on bounded thread pools.  Paths
+    under /api/ get their own pool, so a crowd of slow API readers can only
+    queue behind each other and never takes the threads that serve the HTML
+    pages.  Server-Sent Event streams, which hold their thread for minutes,
+    get a third pool for the same reason.  Response bodies are handed back
+    one chunk at a time through a bounded queue, so streamed exports stay
+    streamed.
+"""
+
+import asyncio
+import io
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_DONE = object()
+
+
+class ASGIAdapter(object):
+    def __init__(self, wsgi_app, api_threads=32, html_threads=4,
+                 stream_threads=10, api_prefix="/api/",
+                 stream_paths=("/tasks/events",), queue_size=8):
+        self.wsgi_app = wsgi_app
+        self.api_prefix = api_prefix
+        self.stream_paths = frozenset(stream_paths)
+        self.queue_size = queue_size
+        self.api_pool = ThreadPoolExecutor(max_workers=api_threads)
+        self.html_pool = ThreadPoolExecutor(max_workers=html_threads)
+        self.stream_pool = ThreadPoolExecutor(max_workers=stream_threads)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] != "http":
+            return
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+        if scope["path"] in self.stream_paths:
+            pool = self.stream_pool
+        elif scope["path"].startswith(self.api_prefix):
+            pool = self.api_pool
+        else:
+            pool = self.html_pool
+
+        loop = asyncio.get_event_loop()
+        queue = asyncio.Queue()
+        # room left in the queue, waited on by the thread without the loop
+        room = threading.Semaphore(self.queue_size)
+        environ = self.environ(scope, body)
+        gone = threading.Event()
+        watcher = loop.create_task(self.watch(receive))
+        job = loop.run_in_executor(
+            pool, self.run_wsgi, environ, loop, queue, room, gone
+        )
+        try:
+            await self.respond(send, queue, room, watcher)
+        finally:
+            # also reached when the server cancels us: either way nobody
+            # reads the queue any more, so the thread must not wait on it
+            gone.set()
+            watcher.cancel()
+        await asyncio.gather(watcher, return_exceptions=True)
+        await job
+
+    async def respond(self, send, queue, room, watcher):
+        """Send what the WSGI app puts on ``queue`` until it or we stop."""
+        item = await self.next_item(queue, room, watcher)
+        if item is _DONE:
+            return
+        status, headers = item
+        await send(
+            {"type": "http.response.start", "status": status,
+             "headers": headers}
+        )
+        while True:
+            chunk = await self.next_item(queue, room, watcher)
+            if chunk is _DONE:
+                break
+            await send(
+                {"type": "http.response.body", "body": chunk,
+                 "more_body": True}
+            )
+        if not watcher.done():
+            await send({"type": "http.response.body", "body": b""})
+
+    async def watch(self, receive):
+        """Return once the client has disconnected."""
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+
+    async def next_item(self, queue, room, watcher):
+        """The next item from ``queue``, or _DONE if the client left."""
+        get = asyncio.ensure_future(queue.get())
+        await asyncio.wait(
+            (get, watcher), return_when=asyncio.FIRST_COMPLETED
+        )
+        if get.done():
+            room.release()
+            return get.result()
+        get.cancel()
+        return _DONE
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.api_pool.shutdown(wait=False)
+                self.html_pool.shutdown(wait=False)
+                self.stream_pool.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def run_wsgi(self, environ, loop, queue, room, gone):
+        """
+        Run one request on a pool thread, feeding ``queue``.
+
+        Once ``gone`` is set the response iterator is closed after its
+        current chunk, so an event stream whose client went away frees its
+        thread and its slot within one keepalive rather than at the end of
+        EVENTS_STREAM_TIMEOUT.
+        """
+
+        def put(item):
+            """Hand ``item`` to the loop; False once nobody is reading."""
+            while not gone.is_set():
+                if room.acquire(timeout=0.1):
+                    try:
+                        loop.call_soon_threadsafe(queue.put_nowait, item)
+                    except RuntimeError:
+                        # the loop is closed
+                        return False
+                    return True
+            return False
+
+        started = []
+
+        def start_response(status, response_headers, exc_info=None):
+            started[:] = [
+                int(status.split(" ", 1)[0]),
+                [
+                    (name.lower().encode("latin-1"), value.encode("latin-1"))
+                    for name, value in response_headers
+                ],
+            ]
+
+        try:
+            result = self.wsgi_app(environ, start_response)
+            chunks = iter(result)
+            first = next(chunks, b"")
+        except BaseException:
+            put((500, [(b"content-type", b"text/plain")]))
+            put(_DONE)
+            raise
+        try:
+            if put(tuple(started)) and (not first or put(first)):
+                for chunk in chunks:
+                    if gone.is_set() or (chunk and not put(chunk)):
+                        break
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+            put(_DONE)
+
+    def environ(self, scope, body):
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client") or ("", 0)
+        path = scope["path"].encode("utf-8").decode("latin-1")
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", ""),
+            "PATH_INFO": path,
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+            "REMOTE_ADDR": client[0],
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in scope.get("headers", []):
+            name = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if name == "CONTENT_TYPE":
+                environ["CONTENT_TYPE"] = value
+            elif name == "CONTENT_LENGTH":
+                environ["CONTENT_LENGTH"] = value
+            else:
+                key = "HTTP_" + name
+                if key in environ:
+                    value = environ[key] + "," + value
+                environ[key] = value
+        return environ
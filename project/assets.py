@@ -0,0 +1,154 @@
+#! /usr/bin/env python3
+#
+################
+#
+# project/assets.py
+#
+################
+#
+
+"""
+    Response compression and static asset delivery.
+
+    Dynamic responses are gzip (or brotli, when the ``brotli`` package is
+    installed) compressed when the client accepts it and the body is big
+    enough to be worth it.  Static files are served from precompressed
+    ``.gz`` / ``.br`` siblings written by ``flask compress-static``, and
+    ``url_for('static', ...)`` adds a content hash to the URL so those
+    responses can be cached for a year.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import click
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    "application/javascript",
+    "application/json",
+    "application/x-ndjson",
+    "image/svg+xml",
+    "text/css",
+    "text/csv",
+    "text/html",
+    "text/javascript",
+    "text/plain",
+}
+
+STATIC_EXTENSIONS = (".css", ".js", ".svg", ".html", ".txt", ".json")
+
+_static_hashes = {}
+
+
+def encodings():
+    """Content codings this server can produce, best first."""
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def compress(data, encoding, level):
+    if encoding == "br":
+        return brotli.compress(data, quality=min(level, 11))
+    return gzip.compress(data, compresslevel=level)
+
+
+def static_hash(app, filename):
+    """Short content hash of a static file, computed once per process."""
+    if filename not in _static_hashes:
+        path = os.path.join(app.static_folder, filename)
+        try:
+            with open(path, "rb") as f:
+                digest = hashlib.sha1(f.read()).hexdigest()[:12]
+        except (IOError, OSError):
+            digest = None
+        _static_hashes[filename] = digest
+    return _static_hashes[filename]
+
+
+def init_app(app):
+    app.config.setdefault("COMPRESS_MIN_SIZE", 500)
+    app.config.setdefault("COMPRESS_LEVEL", 6)
+    app.config.setdefault("STATIC_MAX_AGE", 365 * 24 * 60 * 60)
+
+    @app.after_request
+    def compress_response(response):
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return response
+        response.vary.add("Accept-Encoding")
+        if (
+            response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or "Content-Encoding" in response.headers
+        ):
+            return response
+        data = response.get_data()
+        if len(data) < app.config["COMPRESS_MIN_SIZE"]:
+            return response
+        encoding = request.accept_encodings.best_match(encodings())
+        if encoding is None:
+            return response
+        level = app.config["COMPRESS_LEVEL"]
+        response.set_data(compress(data, encoding, level))
+        response.headers["Content-Encoding"] = encoding
+        # the compressed body is a different byte sequence, so the ETag
+        # can only vouch for semantic equivalence from here on
+        etag, _ = response.get_etag()
+        if etag:
+            response.set_etag(etag, weak=True)
+        return response
+
+    @app.url_defaults
+    def fingerprint_static(endpoint, values):
+        if endpoint == "static" and "filename" in values:
+            digest = static_hash(app, values["filename"])
+            if digest:
+                values.setdefault("v", digest)
+
+    def static(filename):
+        mimetype = mimetypes.guess_type(filename)[0]
+        encoding = request.accept_encodings.best_match(encodings())
+        suffix = {"br": ".br", "gzip": ".gz"}.get(encoding)
+        if suffix and os.path.isfile(
+            os.path.join(app.static_folder, filename + suffix)
+        ):
+            response = send_from_directory(
+                app.static_folder,
+                filename + suffix,
+                mimetype=mimetype,
+            )
+            response.headers["Content-Encoding"] = encoding
+        else:
+            response = send_from_directory(app.static_folder, filename)
+        response.vary.add("Accept-Encoding")
+        if request.args.get("v") == static_hash(app, filename):
+            # fingerprinted URLs change whenever the file does
+            response.headers["Cache-Control"] = (
+                f"public, max-age={app.config['STATIC_MAX_AGE']}, immutable"
+            )
+        return response
+
+    app.view_functions["static"] = static
+
+    @app.cli.command("compress-static")
+    def compress_static():
+        """Write .gz (and .br) copies of the compressible static files."""
+        level = 9
+        for root, _, files in os.walk(app.static_folder):
+            for name in files:
+                if not name.endswith(STATIC_EXTENSIONS):
+                    continue
+                path = os.path.join(root, name)
+                with open(path, "rb") as f:
+                    data = f.read()
+                for encoding in encodings():
+                    suffix = ".br" if encoding == "br" else ".gz"
+                    with open(path + suffix, "wb") as f:
+                        f.write(compress(data, encoding, level))
+                click.echo(os.path.relpath(path, app.static_folder))
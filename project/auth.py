@@ -0,0 +1,150 @@
+#! /usr/bin/env python3
+#
+################
+#
+# project/auth.py
+#
+################
+#
+
+"""
+    Who is making the request, for every blueprint.
+
+    The session cookie only carries the user's id.  ``current_user`` looks
+    the user up at most once per request (kept in ``g``), and the lookup
+    itself goes through a small cache that expires after
+    AUTH_USER_CACHE_TTL seconds, so a change of role or name takes effect
+    within seconds instead of at the next login.  On the API, a bearer
+    token identifies the caller instead of the cookie.
+"""
+
+from collections import namedtuple
+from functools import wraps
+from flask import (
+    abort,
+    flash,
+    g,
+    jsonify,
+    redirect,
+    request,
+    session,
+    url_for,
+)
+from project import app, db
+from project.cache import LRUCache
+from project.models import User
+from project.tokens import verify_token
+
+CurrentUser = namedtuple("CurrentUser", ["id", "name", "role"])
+
+users = LRUCache(
+    app.config["AUTH_USER_CACHE_SIZE"], app.config["AUTH_USER_CACHE_TTL"]
+)
+
+
+def load_user(user_id):
+    """The user with ``user_id`` as a CurrentUser, or None."""
+    user = users.get(user_id)
+    if user is None:
+        row = (
+            db.session.query(User.id, User.name, User.role)
+            .filter(User.id == user_id)
+            .first()
+        )
+        if row is None:
+            return None
+        user = CurrentUser(*row)
+        users.set(user_id, user)
+    return user
+
+
+def bearer_user():
+    auth = request.headers.get("Authorization", "")
+    scheme, _, token = auth.partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+    token_user = verify_token(token.strip())
+    if token_user is None:
+        return None
+    return CurrentUser(token_user.user_id, token_user.name, token_user.role)
+
+
+def current_user():
+    """The logged in user as a CurrentUser, or None."""
+    if "current_user" not in g:
+        user = None
+        if request.blueprint == "api" and "Authorization" in request.headers:
+            user = bearer_user()
+        elif "user_id" in session:
+            user = load_user(session["user_id"])
+        g.current_user = user
+    return g.current_user
+
+
+def login_user(user):
+    session["logged_in"] = True
+    session["user_id"] = user.id
+    users.delete(user.id)
+    g.pop("current_user", None)
+
+
+def logout_user():
+    session.pop("logged_in", None)
+    session.pop("user_id", None)
+    g.pop("current_user", None)
+
+
+def unauthorized():
+    if request.blueprint == "api":
+        response = jsonify(error="You need to login first.")
+        response.status_code = 401
+        response.headers["WWW-Authenticate"] = "Bearer"
+        return response
+    flash("You need to login first.")
+    return redirect(url_for("users.login"))
+
+
+def forbidden():
+    if request.blueprint == "api":
+        response = jsonify(error="You do not have permission to do that.")
+        response.status_code = 403
+        return response
+    abort(403)
+
+
+def login_required(f):
+    @wraps(f)
+    def wrap(*args, **kwargs):
+        if current_user() is None:
+            return unauthorized()
+        return f(*args, **kwargs)
+
+    return wrap
+
+
+def roles_required(*roles):
+    """Like login_required, and answer 403 unless the user has a role."""
+
+    def decorator(f):
+        @wraps(f)
+        def wrap(*args, **kwargs):
+            user = current_user()
+            if user is None:
+                return unauthorized()
+            if user.role not in roles:
+                return forbidden()
+            return f(*args, **kwargs)
+
+        return wrap
+
+    return decorator
+
+
+def is_admin():
+    user = current_user()
+    return user is not None and user.role == "admin"
+
+
+@app.context_processor
+def inject_current_user():
+    return {"current_user": current_user()}
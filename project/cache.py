@@ -0,0 +1,146 @@
+#! /usr/bin/env python3
+#
+################
+#
+# project/cache.py
+#
+################
+#
+
+"""
+    Response cache for read-only routes.
+
+    Cached entries live in a pluggable backend.  The default is an
+    in-process LRU with a TTL; API_CACHE_BACKEND can name any other factory
+    that takes the app and returns an object with the same get / set /
+    clear methods, such as a client for a cache shared between workers.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import Response, request
+from werkzeug.utils import import_string
+
+
+class LRUCache(object):
+    """Thread-safe LRU cache whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def lru_backend(app):
+    return LRUCache(app.config["API_CACHE_SIZE"], app.config["API_CACHE_TTL"])
+
+
+class ResponseCache(object):
+    """
+    Caches successful GET responses by path and query string.
+
+    Clearing the cache after a commit is not enough on its own: a miss
+    computed before the commit can be stored after the clear.  A function
+    registered with ``versioned_by`` is therefore part of every key, so
+    such an entry is filed under the old version and never served again.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("API_CACHE_BACKEND", "project.cache.lru_backend")
+        app.config.setdefault("API_CACHE_SIZE", 1024)
+        app.config.setdefault("API_CACHE_TTL", 30)
+        self.backend = import_string(app.config["API_CACHE_BACKEND"])(app)
+
+    def cached(self, f):
+        """
+        Serve the view from the cache when possible.
+
+        Hits are still checked against the client's If-None-Match /
+        If-Modified-Since, so a cached entry can answer with a 304 too.
+        """
+
+        @wraps(f)
+        def wrap(*args, **kwargs):
+            key = request.full_path
+            if self.version is not None:
+                key = f"{self.version()}:{key}"
+            entry = self.backend.get(key)
+            if entry is not None:
+                with self._lock:
+                    self.hits += 1
+                body, status, headers = entry
+                response = Response(body, status=status, headers=headers)
+                return response.make_conditional(request)
+            with self._lock:
+                self.misses += 1
+            response = f(*args, **kwargs)
+            if response.status_code == 200:
+                self.backend.set(
+                    key,
+                    (
+                        response.get_data(),
+                        response.status_code,
+                        list(response.headers.items()),
+                    ),
+                )
+            return response
+
+        return wrap
+
+    def versioned_by(self, f):
+        """Register a function whose result is part of every cache key."""
+        self.version = f
+        return f
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        stats = {"hits": self.hits, "misses": self.misses}
+        try:
+            stats["size"] = len(self.backend)
+        except TypeError:
+            pass
+        return stats
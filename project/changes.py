@@ -0,0 +1,101 @@
+#! /usr/bin/env python3
+#
+################
+#
+# project/changes.py
+#
+################
+#
+
+"""
+    Change tracking for the tasks table.
+
+    Every transaction that writes to ``tasks`` bumps a row in the
+    ``versions`` table, inside that same transaction.  Readers compare the
+    counter instead of the data, and code that keeps derived copies of the
+    tasks (caches and the like) can register a callback with
+    ``on_tasks_changed`` that runs once the write has been committed.
+"""
+
+import datetime
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from project import db
+from project.models import Task, Version
+
+TASKS = "tasks"
+
+_listeners = []
+
+
+def current_version(name=TASKS):
+    """Return ``(version, modified)`` for a counter, ``(0, None)`` if new."""
+    table = Version.__table__
+    row = db.session.execute(
+        select([table.c.version, table.c.modified]).where(
+            table.c.name == name
+        )
+    ).first()
+    if row is None:
+        return 0, None
+    return row[0], row[1]
+
+
+def bump_version(session, name=TASKS):
+    """Increment a counter in the session's current transaction."""
+    table = Version.__table__
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    result = session.execute(
+        table.update()
+        .where(table.c.name == name)
+        .values(version=table.c.version + 1, modified=now)
+    )
+    if result.rowcount == 0:
+        session.execute(
+            table.insert().values(name=name, version=1, modified=now)
+        )
+
+
+def mark_tasks_changed(session):
+    """
+    Record that the current transaction wrote to the tasks table.
+
+    The ORM hooks below call this automatically; code that writes with
+    Core statements has to call it itself.
+    """
+    if not session.info.get("tasks_changed"):
+        bump_version(session)
+        session.info["tasks_changed"] = True
+
+
+def on_tasks_changed(f):
+    """Register ``f`` to be called after a tasks write is committed."""
+    _listeners.append(f)
+    return f
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context):
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, Task):
+            mark_tasks_changed(session)
+            return
+
+
+@event.listens_for(Session, "after_bulk_update")
+@event.listens_for(Session, "after_bulk_delete")
+def _after_bulk(update_context):
+    if update_context.mapper.class_ is Task:
+        mark_tasks_changed(update_context.session)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    if session.info.pop("tasks_changed", False):
+        for f in _listeners:
+            f()
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("tasks_changed", None)
@@ -0,0 +1,145 @@
+#! /usr/bin/env python3
+#
+################
+#
+# project/counters.py
+#
+################
+#
+
+"""
+    Per-user open and closed task counts.
+
+    ``task_counts`` holds one row per user, kept up to date by triggers on
+    ``tasks`` inside the writing transaction, so reading a user's counts is
+    a primary key lookup however many tasks they have.  The overdue count
+    depends on the date too, so it is cached per day and tasks version
+    instead, and taken again at most once per write or per day.
+"""
+
+import datetime
+import click
+from sqlalchemy import DDL, event, func
+from project import app, db
+from project.cache import LRUCache
+from project.changes import current_version, on_tasks_changed
+from project.models import Task, TaskCount
+
+# make sure the user has a counter row, then move the counts by ``sign``
+_COUNT = (
+    "INSERT OR IGNORE INTO task_counts (user_id, open, closed) "
+    "VALUES ({row}.user_id, 0, 0); "
+    "UPDATE task_counts SET "
+    "open = open {sign} ({row}.status = 1), "
+    "closed = closed {sign} ({row}.status = 0) "
+    "WHERE user_id = {row}.user_id;"
+)
+
+CREATE_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS task_counts_insert AFTER INSERT ON tasks "
+    "WHEN new.user_id IS NOT NULL "
+    "BEGIN " + _COUNT.format(row="new", sign="+") + " END",
+    "CREATE TRIGGER IF NOT EXISTS task_counts_delete AFTER DELETE ON tasks "
+    "WHEN old.user_id IS NOT NULL "
+    "BEGIN " + _COUNT.format(row="old", sign="-") + " END",
+    "CREATE TRIGGER IF NOT EXISTS task_counts_update_old "
+    "AFTER UPDATE OF status, user_id ON tasks "
+    "WHEN old.user_id IS NOT NULL "
+    "BEGIN " + _COUNT.format(row="old", sign="-") + " END",
+    "CREATE TRIGGER IF NOT EXISTS task_counts_update_new "
+    "AFTER UPDATE OF status, user_id ON tasks "
+    "WHEN new.user_id IS NOT NULL "
+    "BEGIN " + _COUNT.format(row="new", sign="+") + " END",
+]
+
+# archived tasks still count as closed: archiving moves a task from tasks
+# to tasks_archive, and the two triggers below cancel out the delete
+_ARCHIVED = (
+    "INSERT OR IGNORE INTO task_counts (user_id, open, closed) "
+    "VALUES ({row}.user_id, 0, 0); "
+    "UPDATE task_counts SET closed = closed {sign} 1 "
+    "WHERE user_id = {row}.user_id;"
+)
+
+CREATE_ARCHIVE_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS task_counts_archive_insert "
+    "AFTER INSERT ON tasks_archive WHEN new.user_id IS NOT NULL "
+    "BEGIN " + _ARCHIVED.format(row="new", sign="+") + " END",
+    "CREATE TRIGGER IF NOT EXISTS task_counts_archive_delete "
+    "AFTER DELETE ON tasks_archive WHEN old.user_id IS NOT NULL "
+    "BEGIN " + _ARCHIVED.format(row="old", sign="-") + " END",
+]
+
+REBUILD_COUNTS = [
+    "DELETE FROM task_counts",
+    "INSERT OR REPLACE INTO task_counts (user_id, open, closed) "
+    "SELECT user_id, SUM(status = 1), SUM(status = 0) FROM ("
+    "SELECT user_id, status FROM tasks "
+    "UNION ALL SELECT user_id, 0 FROM tasks_archive) "
+    "WHERE user_id IS NOT NULL GROUP BY user_id",
+]
+
+# overdue counts, keyed on the user, the day and the tasks version
+overdue_counts = LRUCache(
+    app.config["COUNTS_CACHE_SIZE"], app.config["COUNTS_CACHE_TTL"]
+)
+on_tasks_changed(overdue_counts.clear)
+
+# the triggers span several tables, so they go in once all of them exist
+for statement in CREATE_TRIGGERS + CREATE_ARCHIVE_TRIGGERS:
+    event.listen(
+        db.metadata,
+        "after_create",
+        DDL(statement).execute_if(dialect="sqlite"),
+    )
+
+
+def overdue_count(user_id, today=None):
+    """
+    Open tasks of ``user_id`` due before ``today``.
+
+    Counted with a range over ix_tasks_user_id_status_due_date that only
+    visits the overdue entries, then served from ``overdue_counts`` until
+    the next write or the next day.
+    """
+    today = today or datetime.date.today()
+    version, _ = current_version()
+    key = (user_id, today, version)
+    count = overdue_counts.get(key)
+    if count is None:
+        count = (
+            db.session.query(func.count(Task.task_id))
+            .filter(
+                Task.user_id == user_id,
+                Task.status == 1,
+                Task.due_date < today,
+            )
+            .scalar()
+        )
+        overdue_counts.set(key, count)
+    return count
+
+
+def task_counts(user_id):
+    """Open, closed and overdue task counts for ``user_id``."""
+    row = db.session.query(TaskCount).get(user_id)
+    counts = {"open": 0, "closed": 0, "overdue": 0}
+    if row is not None:
+        counts["open"], counts["closed"] = row.open, row.closed
+        if row.open:
+            counts["overdue"] = overdue_count(user_id)
+    return counts
+
+
+def rebuild_counts(conn):
+    for statement in REBUILD_COUNTS:
+        conn.execute(statement)
+
+
+def init_app(app, db):
+    @app.cli.command("counts-rebuild")
+    def counts_rebuild():
+        """Recount every user's tasks from the tasks table."""
+        with db.engine.begin() as conn:
+            rebuild_counts(conn)
+        click.echo("task counts rebuilt")
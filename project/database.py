@@ -0,0 +1,219 @@
+#! /usr/bin/env python3
+#
+################
+#
+# project/database.py
+#
+################
+#
+
+"""
+    Engine setup for SQLite under several workers.
+
+    Every new connection gets the SQLITE_* pragmas from the config: WAL
+    lets readers carry on while a write is in progress, busy_timeout makes
+    a writer wait its turn instead of failing with "database is locked",
+    and cache_size / mmap_size keep hot pages in memory.  A file database
+    also gets a real connection pool sized by SQLALCHEMY_POOL_SIZE and
+    SQLALCHEMY_MAX_OVERFLOW rather than a fresh connection per checkout.
+
+    This leans on Flask-SQLAlchemy internals (SignallingSession, the
+    driver hacks hook) and on Session._flushing, which is why the Pipfile
+    pins flask-sqlalchemy to 2.3.2.
+
+    With SQLALCHEMY_REPLICA_URIS set, the session sends plain SELECTs to a
+    replica and everything else to the primary.  A session that has
+    written reads from the primary until the end of its transaction, and
+    for SQLALCHEMY_REPLICA_STICKY_SECONDS after the commit, for that
+    session and for the browser that made the request, so a redirect
+    after a POST sees its own write even while the replicas lag behind.
+"""
+
+import random
+import time
+import weakref
+from flask import has_request_context, session as flask_session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy as _SQLAlchemy
+from sqlalchemy import create_engine, event, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool, StaticPool
+from sqlalchemy.sql import Select
+
+PRAGMAS = (
+    ("journal_mode", "SQLITE_JOURNAL_MODE"),
+    ("synchronous", "SQLITE_SYNCHRONOUS"),
+    ("busy_timeout", "SQLITE_BUSY_TIMEOUT"),
+    ("cache_size", "SQLITE_CACHE_SIZE"),
+    ("mmap_size", "SQLITE_MMAP_SIZE"),
+)
+
+POOL_OPTIONS = ("pool_size", "max_overflow", "pool_timeout", "pool_recycle")
+
+# engines that already set the pragmas on connect
+_configured = weakref.WeakSet()
+
+
+def sqlite_pragmas(config):
+    """The PRAGMA statements to run on each new connection."""
+    return [
+        f"PRAGMA {pragma} = {config[key]}"
+        for pragma, key in PRAGMAS
+        if config.get(key) is not None
+    ]
+
+
+def set_pragmas_on_connect(engine, config):
+    """Run the configured pragmas on each new connection of engine."""
+    if engine.dialect.name != "sqlite" or engine in _configured:
+        return
+    statements = sqlite_pragmas(config)
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.close()
+
+    _configured.add(engine)
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session that reads from a replica unless it has to see its own writes.
+    """
+
+    STICKY_KEY = "_db_sticky_until"
+
+    def __init__(self, db, **options):
+        self.db = db
+        super(RoutingSession, self).__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        primary = super(RoutingSession, self).get_bind(mapper, clause)
+        if (
+            isinstance(clause, Select)
+            and primary is self.bind
+            and not self._flushing
+            and not self.sticky()
+        ):
+            replica = self.replica()
+            if replica is not None:
+                return replica
+        elif clause is not None and not isinstance(clause, Select):
+            # Core inserts, updates and deletes never reach the flush hooks
+            self.info["wrote"] = True
+        return primary
+
+    def replica(self):
+        """The replica engine this session reads from, if any."""
+        engines = self.db.get_replica_engines(self.app)
+        if not engines:
+            return None
+        if "replica" not in self.info:
+            self.info["replica"] = random.randrange(len(engines))
+        return engines[self.info["replica"] % len(engines)]
+
+    def sticky(self):
+        """Whether reads must go to the primary to see recent writes."""
+        if self.info.get("wrote"):
+            return True
+        now = time.time()
+        if self.info.get("sticky_until", 0) > now:
+            return True
+        return (
+            has_request_context()
+            and flask_session.get(self.STICKY_KEY, 0) > now
+        )
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _flushed(session, flush_context):
+    session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "after_bulk_update")
+@event.listens_for(RoutingSession, "after_bulk_delete")
+def _bulk_written(update_context):
+    update_context.session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _committed(session):
+    if not session.info.pop("wrote", False):
+        return
+    if not session.db.get_replica_engines(session.app):
+        return
+    seconds = session.app.config["SQLALCHEMY_REPLICA_STICKY_SECONDS"]
+    session.info["sticky_until"] = until = time.time() + seconds
+    if has_request_context():
+        flask_session[RoutingSession.STICKY_KEY] = until
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _rolled_back(session):
+    session.info.pop("wrote", None)
+
+
+class SQLAlchemy(_SQLAlchemy):
+    def __init__(self, *args, **kwargs):
+        # (uris, engines) for the configured replicas
+        self._replicas = ((), [])
+        super(SQLAlchemy, self).__init__(*args, **kwargs)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def init_app(self, app):
+        app.config.setdefault("SQLALCHEMY_REPLICA_URIS", [])
+        app.config.setdefault("SQLALCHEMY_REPLICA_STICKY_SECONDS", 5)
+        app.config.setdefault("SQLITE_JOURNAL_MODE", "wal")
+        app.config.setdefault("SQLITE_SYNCHRONOUS", "normal")
+        app.config.setdefault("SQLITE_BUSY_TIMEOUT", 5000)
+        app.config.setdefault("SQLITE_CACHE_SIZE", None)
+        app.config.setdefault("SQLITE_MMAP_SIZE", None)
+        super(SQLAlchemy, self).init_app(app)
+
+    def apply_driver_hacks(self, app, info, options):
+        # Flask-SQLAlchemy 2.4+ uses the return value, so pass it through
+        result = super(SQLAlchemy, self).apply_driver_hacks(app, info, options)
+        if info.drivername != "sqlite":
+            return result
+        if options.get("poolclass") is StaticPool:
+            # one shared in-memory connection: there is nothing to size
+            for option in POOL_OPTIONS:
+                options.pop(option, None)
+        elif options.get("pool_size"):
+            options["poolclass"] = QueuePool
+            options.setdefault("connect_args", {})
+            # pooled connections are handed from thread to thread
+            options["connect_args"]["check_same_thread"] = False
+        return result
+
+    def get_engine(self, app=None, bind=None):
+        engine = super(SQLAlchemy, self).get_engine(app, bind)
+        set_pragmas_on_connect(engine, self.get_app(app).config)
+        return engine
+
+    def get_replica_engines(self, app=None):
+        """Engines for SQLALCHEMY_REPLICA_URIS, built on first use."""
+        app = self.get_app(app)
+        uris = tuple(app.config["SQLALCHEMY_REPLICA_URIS"] or ())
+        with self._engine_lock:
+            if self._replicas[0] != uris:
+                for engine in self._replicas[1]:
+                    engine.dispose()
+                self._replicas = (
+                    uris,
+                    [self.create_replica_engine(app, uri) for uri in uris],
+                )
+            return self._replicas[1]
+
+    def create_replica_engine(self, app, uri):
+        info = make_url(uri)
+        options = {"convert_unicode": True}
+        self.apply_pool_defaults(app, options)
+        self.apply_driver_hacks(app, info, options)
+        engine = create_engine(info, **options)
+        set_pragmas_on_connect(engine, app.config)
+        return engine
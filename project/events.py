@@ -0,0 +1,185 @@
+#! /usr/bin/env python3
+#
+################
+#
+# project/events.py
+#
+################
+#
+
+"""
+    Publish/subscribe for live task updates, streamed as Server-Sent Events.
+
+    Messages go through a pluggable broker.  The default is in-process, so
+    it only reaches subscribers served by the same process; EVENTS_BACKEND
+    can name any other factory that takes the app and returns an object
+    with the same publish / subscribe methods, such as one backed by a
+    message bus shared between workers.
+
+    Each open stream holds a server thread until it ends, so a process
+    serves at most EVENTS_MAX_STREAMS of them; past that a client gets 204
+    No Content, which tells EventSource to stop reconnecting, and the
+    dashboard simply goes without live updates.  Keep the limit below the
+    thread count of the worker class, e.g. gunicorn's gthread worker with
+    --threads 16 (a sync worker would be held by a single stream), or run
+    the ASGI front end, which gives streams their own pool.
+"""
+
+import json
+import queue
+import threading
+import time
+from werkzeug.utils import import_string
+
+
+class Subscription(object):
+    """One subscriber's queue of messages on a channel."""
+
+    def __init__(self, broker, channel, maxsize):
+        self.broker = broker
+        self.channel = channel
+        self.queue = queue.Queue(maxsize)
+        # set when a message had to be dropped because the queue was full
+        self.lagged = False
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.lagged = True
+
+    def get(self, timeout=None):
+        """The next message, or None if none came within ``timeout``."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker(object):
+    """Thread-safe in-process broker with a bounded queue per subscriber."""
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.put(message)
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel, self.queue_size)
+        with self._lock:
+            self._subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(s) for s in self._subscriptions.values())
+
+
+def local_backend(app):
+    return LocalBroker(app.config["EVENTS_QUEUE_SIZE"])
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class EventStream(object):
+    """
+    Iterator over one client's stream that gives its slot back on close().
+
+    A generator's ``finally`` never runs if it was not started, so the
+    slot is released here rather than in the generator.
+    """
+
+    def __init__(self, chunks, release):
+        self.chunks = chunks
+        self.release = release
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.chunks)
+
+    def close(self):
+        if self.release is None:
+            return
+        try:
+            self.chunks.close()
+        finally:
+            self.release()
+            self.release = None
+
+
+class Events(object):
+    """Publishes named events on channels and streams them to clients."""
+
+    def __init__(self, app=None):
+        self.broker = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("EVENTS_BACKEND", "project.events.local_backend")
+        app.config.setdefault("EVENTS_QUEUE_SIZE", 100)
+        app.config.setdefault("EVENTS_KEEPALIVE", 15)
+        app.config.setdefault("EVENTS_STREAM_TIMEOUT", 300)
+        app.config.setdefault("EVENTS_MAX_STREAMS", 8)
+        self.app = app
+        self.slots = threading.BoundedSemaphore(
+            app.config["EVENTS_MAX_STREAMS"]
+        )
+        self.broker = import_string(app.config["EVENTS_BACKEND"])(app)
+
+    def publish(self, channel, event, **data):
+        self.broker.publish(channel, (event, data))
+
+    def stream(self, channel):
+        """
+        Server-Sent Events for ``channel`` as an EventStream of text chunks,
+        or None if EVENTS_MAX_STREAMS streams are already open.
+
+        A comment goes out every EVENTS_KEEPALIVE seconds so proxies keep
+        the connection open, and the stream ends after EVENTS_STREAM_TIMEOUT
+        seconds so a connection cannot hold a worker forever; EventSource
+        reconnects by itself.  A subscriber that fell too far behind gets a
+        ``reload`` event instead of a partial history.
+        """
+        if not self.slots.acquire(blocking=False):
+            return None
+        return EventStream(self.chunks(channel), self.slots.release)
+
+    def chunks(self, channel):
+        keepalive = self.app.config["EVENTS_KEEPALIVE"]
+        deadline = time.monotonic() + self.app.config["EVENTS_STREAM_TIMEOUT"]
+        subscription = self.broker.subscribe(channel)
+        try:
+            yield "retry: 3000\n\n"
+            while time.monotonic() < deadline:
+                message = subscription.get(keepalive)
+                if subscription.lagged:
+                    yield format_event("reload", {})
+                    return
+                if message is None:
+                    yield ": keepalive\n\n"
+                else:
+                    yield format_event(*message)
+        finally:
+            subscription.close()
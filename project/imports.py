@@ -0,0 +1,197 @@
+#! /usr/bin/env python3
+#
+################
+#
+# project/imports.py
+#
+################
+#
+
+"""
+    Bulk import of users from CSV or JSON.
+
+    Rows are read as a stream and handled IMPORT_BATCH_SIZE at a time: the
+    batch's passwords are hashed across a pool of processes (one per CPU
+    by default), then the batch is inserted in one transaction.  A row that
+    breaks a unique constraint is reported and skipped without losing the
+    rest of its batch.
+"""
+
+import csv
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice, repeat
+import click
+from sqlalchemy.exc import IntegrityError
+from project.models import User
+from project.passwords import hash_password
+
+FIELDS = ("name", "email", "password")
+
+# what may come between the items of a JSON array
+SEPARATORS = re.compile(r"[\s,]*")
+
+
+def read_csv(f):
+    for record in csv.DictReader(f):
+        yield record
+
+
+def read_json(f):
+    """A JSON array of users, or one JSON object per line."""
+    first = f.read(1)
+    while first.isspace():
+        first = f.read(1)
+    if first == "[":
+        yield from read_json_array(f)
+        return
+    for line in chain([first + f.readline()], f):
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_json_array(f, chunk_size=64 * 1024):
+    """
+    The items of a JSON array whose opening bracket has been read, parsed
+    one at a time from ``chunk_size`` reads so the file is never held in
+    memory whole.
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+    while True:
+        pos = SEPARATORS.match(buf, pos).end()
+        if buf.startswith("]", pos):
+            return
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            end = None
+        # an item that runs to the end of the buffer may not be complete
+        if end is not None and (end < len(buf) or eof):
+            yield item
+            pos = end
+            continue
+        if eof:
+            raise ValueError("unterminated JSON array")
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buf, pos = buf[pos:] + chunk, 0
+
+
+def clean(record):
+    """The columns to insert for one record; raises ValueError if bad."""
+    if not isinstance(record, dict):
+        raise ValueError("not an object")
+    missing = [field for field in FIELDS if not record.get(field)]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    return {
+        "name": str(record["name"]).strip(),
+        "email": str(record["email"]).strip(),
+        "password": str(record["password"]),
+        "role": record.get("role") or "user",
+    }
+
+
+def insert_batch(engine, batch):
+    """
+    Insert ``batch`` of (number, row) pairs, returning the rows that broke
+    a constraint as (number, message) pairs.
+
+    The batch goes in as one executemany; only if that fails is it redone
+    row by row, still in a single transaction, to find the culprits.
+    """
+    table = User.__table__
+    try:
+        with engine.begin() as conn:
+            conn.execute(table.insert(), [row for _, row in batch])
+        return []
+    except IntegrityError:
+        pass
+    errors = []
+    with engine.begin() as conn:
+        for number, row in batch:
+            try:
+                conn.execute(table.insert(), row)
+            except IntegrityError as e:
+                errors.append((number, str(e.orig)))
+    return errors
+
+
+def import_users(engine, records, rounds, batch_size=500, processes=None):
+    """
+    Import ``records`` (dicts with name, email, password and an optional
+    role), returning the number imported and a list of (number, message)
+    pairs for the records that were not.
+    """
+    imported, errors = 0, []
+    numbered = enumerate(records, 1)
+    with ProcessPoolExecutor(processes) as pool:
+        chunksize = max(1, batch_size // (processes or os.cpu_count() or 1))
+        while True:
+            records = list(islice(numbered, batch_size))
+            if not records:
+                break
+            batch = []
+            for number, record in records:
+                try:
+                    batch.append((number, clean(record)))
+                except ValueError as e:
+                    errors.append((number, str(e)))
+            if not batch:
+                continue
+            hashes = pool.map(
+                hash_password,
+                [row["password"] for _, row in batch],
+                repeat(rounds),
+                chunksize=chunksize,
+            )
+            for (_, row), pw_hash in zip(batch, hashes):
+                row["password"] = pw_hash
+            failed = insert_batch(engine, batch)
+            imported += len(batch) - len(failed)
+            errors.extend(failed)
+    errors.sort()
+    return imported, errors
+
+
+def init_app(app, db):
+    app.config.setdefault("IMPORT_BATCH_SIZE", 500)
+
+    @app.cli.command("users-import")
+    @click.argument("path", type=click.File("r", encoding="utf-8"))
+    @click.option(
+        "--format",
+        "fmt",
+        type=click.Choice(["csv", "json"]),
+        default=None,
+        help="File format; guessed from the extension if not given.",
+    )
+    @click.option(
+        "--batch-size",
+        default=app.config["IMPORT_BATCH_SIZE"],
+        help="Users per transaction.",
+    )
+    @click.option(
+        "--processes",
+        type=int,
+        default=None,
+        help="Hashing processes; one per CPU by default.",
+    )
+    def users_import(path, fmt, batch_size, processes):
+        """Create users from a CSV or JSON file."""
+        if fmt is None:
+            fmt = "csv" if path.name.lower().endswith(".csv") else "json"
+        records = read_csv(path) if fmt == "csv" else read_json(path)
+        imported, errors = import_users(
+            db.engine,
+            records,
+            app.config["BCRYPT_LOG_ROUNDS"],
+            batch_size,
+            processes,
+        )
+        for number, message in errors:
+            click.echo(f"record {number}: {message}", err=True)
+        click.echo(f"imported {imported} users, {len(errors)} skipped")
@@ -0,0 +1,400 @@
+#! /usr/bin/env python3
+#
+################
+#
+# project/migrations.py
+#
+################
+#
+
+"""
+    Versioned schema migrations.
+
+    Each migration is a function registered under a revision name with
+    ``@migration(...)``; ``upgrade`` runs the ones that are not yet listed
+    in the ``schema_migrations`` table, in order.  Migrations get a
+    ``Migrator`` with helpers for the operations SQLite needs: adding and
+    dropping indexes, and rebuilding a table online, copying its rows over
+    in bounded chunks while triggers mirror any concurrent writes.
+"""
+
+import datetime
+import click
+
+MIGRATIONS = []
+
+
+def migration(revision):
+    """Register a migration function under ``revision``."""
+
+    def register(f):
+        MIGRATIONS.append((revision, f))
+        return f
+
+    return register
+
+
+class Migrator(object):
+    def __init__(self, engine, chunk_size=1000, progress=None):
+        self.engine = engine
+        self.chunk_size = chunk_size
+        self.progress = progress
+
+    def execute(self, sql, *params):
+        with self.engine.begin() as conn:
+            conn.execute(sql, *params)
+
+    def fetchall(self, sql, *params):
+        with self.engine.begin() as conn:
+            return conn.execute(sql, *params).fetchall()
+
+    def has_table(self, table):
+        return self.engine.has_table(table)
+
+    def columns(self, table):
+        return [
+            row[1] for row in self.fetchall(f"PRAGMA table_info({table})")
+        ]
+
+    def create_index(self, name, table, *columns, unique=False):
+        unique = "UNIQUE " if unique else ""
+        self.execute(
+            f"CREATE {unique}INDEX IF NOT EXISTS {name} "
+            f"ON {table} ({', '.join(columns)})"
+        )
+
+    def drop_index(self, name):
+        self.execute(f"DROP INDEX IF EXISTS {name}")
+
+    def rebuild_table(self, table, create_sql, columns, indexes=()):
+        """
+        Recreate ``table`` from ``create_sql`` without locking it for long.
+
+        ``create_sql`` is a CREATE TABLE statement with a ``{table}``
+        placeholder for the name, ``columns`` maps each new column to an SQL
+        expression over the old row, and ``indexes`` are CREATE INDEX
+        statements to run once the new table has taken the old one's place.
+        The table's INTEGER PRIMARY KEY must be carried over unchanged.
+
+        Rows are copied in chunks of ``chunk_size``, one transaction each,
+        so memory use and write-lock time are bounded by the chunk.  While
+        the copy runs, triggers on the old table replay inserts, updates
+        and deletes into the new one, and the final swap is a single short
+        transaction.
+        """
+        new = f"_new_{table}"
+        names = ", ".join(columns)
+        exprs = ", ".join(columns.values())
+        copy = (
+            f"INSERT OR REPLACE INTO {new} ({names}) "
+            f"SELECT {exprs} FROM {table}"
+        )
+        triggers = {
+            f"_mirror_{table}_insert": f"AFTER INSERT ON {table} BEGIN "
+            f"{copy} WHERE rowid = NEW.rowid; END",
+            f"_mirror_{table}_update": f"AFTER UPDATE ON {table} BEGIN "
+            f"DELETE FROM {new} WHERE rowid = OLD.rowid; "
+            f"{copy} WHERE rowid = NEW.rowid; END",
+            f"_mirror_{table}_delete": f"AFTER DELETE ON {table} BEGIN "
+            f"DELETE FROM {new} WHERE rowid = OLD.rowid; END",
+        }
+        with self.engine.begin() as conn:
+            conn.execute(f"DROP TABLE IF EXISTS {new}")
+            conn.execute(create_sql.format(table=new))
+            for name, body in triggers.items():
+                conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+                conn.execute(f"CREATE TRIGGER {name} {body}")
+
+        last, copied = None, 0
+        while True:
+            with self.engine.begin() as conn:
+                after = "" if last is None else f"WHERE rowid > {last}"
+                upper = conn.execute(
+                    f"SELECT max(rowid), count(*) FROM (SELECT rowid "
+                    f"FROM {table} {after} ORDER BY rowid LIMIT ?)",
+                    (self.chunk_size,),
+                ).first()
+                if upper[0] is None:
+                    break
+                lower = "" if last is None else f"rowid > {last} AND"
+                conn.execute(f"{copy} WHERE {lower} rowid <= {upper[0]}")
+            last = upper[0]
+            copied += upper[1]
+            if self.progress:
+                self.progress(table, copied)
+
+        with self.engine.begin() as conn:
+            for name in triggers:
+                conn.execute(f"DROP TRIGGER {name}")
+            conn.execute(f"DROP TABLE {table}")
+            conn.execute(f"ALTER TABLE {new} RENAME TO {table}")
+            for sql in indexes:
+                conn.execute(sql)
+
+
+def ensure_migrations_table(engine):
+    with engine.begin() as conn:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "revision VARCHAR PRIMARY KEY, applied_at DATETIME)"
+        )
+
+
+def applied_revisions(engine):
+    ensure_migrations_table(engine)
+    with engine.begin() as conn:
+        rows = conn.execute("SELECT revision FROM schema_migrations")
+        return {row[0] for row in rows.fetchall()}
+
+
+def record(engine, revision):
+    with engine.begin() as conn:
+        conn.execute(
+            "INSERT INTO schema_migrations (revision, applied_at) "
+            "VALUES (?, ?)",
+            (revision, datetime.datetime.utcnow()),
+        )
+
+
+def upgrade(engine, chunk_size=1000, progress=None):
+    """Apply every pending migration, returning their revisions."""
+    done = applied_revisions(engine)
+    migrator = Migrator(engine, chunk_size, progress)
+    ran = []
+    for revision, f in MIGRATIONS:
+        if revision in done:
+            continue
+        f(migrator)
+        record(engine, revision)
+        ran.append(revision)
+    return ran
+
+
+def stamp(engine):
+    """Mark every migration as applied, for a database made by create_all."""
+    done = applied_revisions(engine)
+    for revision, _ in MIGRATIONS:
+        if revision not in done:
+            record(engine, revision)
+
+
+def init_app(app, db):
+    @app.cli.command("db-upgrade")
+    @click.option("--chunk-size", default=1000, help="Rows copied per batch.")
+    def db_upgrade(chunk_size):
+        """Apply pending schema migrations."""
+
+        def progress(table, copied):
+            click.echo(f"  {table}: {copied} rows copied")
+
+        for revision in upgrade(db.engine, chunk_size, progress):
+            click.echo(f"applied {revision}")
+
+    @app.cli.command("db-status")
+    def db_status():
+        """List schema migrations and whether they have been applied."""
+        done = applied_revisions(db.engine)
+        for revision, _ in MIGRATIONS:
+            mark = "x" if revision in done else " "
+            click.echo(f"[{mark}] {revision}")
+
+
+#
+# migrations
+#
+
+
+@migration("0001_initial")
+def initial(m):
+    if not m.has_table("users"):
+        m.execute(
+            "CREATE TABLE users ("
+            "id INTEGER NOT NULL PRIMARY KEY, "
+            "name VARCHAR NOT NULL UNIQUE, "
+            "email VARCHAR NOT NULL UNIQUE, "
+            "password VARCHAR NOT NULL)"
+        )
+    if not m.has_table("tasks"):
+        m.execute(
+            "CREATE TABLE tasks ("
+            "task_id INTEGER NOT NULL PRIMARY KEY, "
+            "name VARCHAR NOT NULL, "
+            "due_date DATE NOT NULL, "
+            "priority INTEGER NOT NULL, "
+            "posted_date DATE, "
+            "status INTEGER, "
+            "user_id INTEGER REFERENCES users (id))"
+        )
+
+
+@migration("0002_users_role")
+def users_role(m):
+    if "role" in m.columns("users"):
+        return
+    m.rebuild_table(
+        "users",
+        "CREATE TABLE {table} ("
+        "id INTEGER NOT NULL PRIMARY KEY, "
+        "name VARCHAR NOT NULL UNIQUE, "
+        "email VARCHAR NOT NULL UNIQUE, "
+        "password VARCHAR NOT NULL, "
+        "role VARCHAR)",
+        {
+            "id": "id",
+            "name": "name",
+            "email": "email",
+            "password": "password",
+            "role": "'user'",
+        },
+    )
+
+
+@migration("0003_tasks_indexes")
+def tasks_indexes(m):
+    m.create_index("ix_tasks_due_date", "tasks", "due_date")
+    m.create_index("ix_tasks_status_due_date", "tasks", "status", "due_date")
+    m.create_index("ix_tasks_status_priority", "tasks", "status", "priority")
+    m.create_index(
+        "ix_tasks_priority_due_date", "tasks", "priority", "due_date"
+    )
+    m.create_index(
+        "ix_tasks_user_id_status_due_date",
+        "tasks",
+        "user_id",
+        "status",
+        "due_date",
+    )
+
+
+@migration("0004_versions")
+def versions(m):
+    m.execute(
+        "CREATE TABLE IF NOT EXISTS versions ("
+        "name VARCHAR NOT NULL PRIMARY KEY, "
+        "version INTEGER NOT NULL, "
+        "modified DATETIME)"
+    )
+
+
+@migration("0005_tasks_fts")
+def tasks_fts(m):
+    from project.search import CREATE_FTS, REBUILD_FTS
+
+    for statement in CREATE_FTS + [REBUILD_FTS]:
+        m.execute(statement)
+
+
+@migration("0006_task_counts")
+def task_counts(m):
+    from project.counters import CREATE_TRIGGERS
+
+    m.execute(
+        "CREATE TABLE IF NOT EXISTS task_counts ("
+        "user_id INTEGER NOT NULL PRIMARY KEY, "
+        "open INTEGER NOT NULL, "
+        "closed INTEGER NOT NULL)"
+    )
+    for statement in CREATE_TRIGGERS:
+        m.execute(statement)
+    with m.engine.begin() as conn:
+        conn.execute("DELETE FROM task_counts")
+        conn.execute(
+            "INSERT OR REPLACE INTO task_counts (user_id, open, closed) "
+            "SELECT user_id, SUM(status = 1), SUM(status = 0) FROM tasks "
+            "WHERE user_id IS NOT NULL GROUP BY user_id"
+        )
+
+
+@migration("0007_tasks_archive")
+def tasks_archive(m):
+    from project.counters import (
+        CREATE_ARCHIVE_TRIGGERS,
+        CREATE_TRIGGERS,
+        rebuild_counts,
+    )
+    from project.search import CREATE_FTS, REBUILD_FTS
+
+    # AUTOINCREMENT, so ids of archived tasks are not reused
+    m.rebuild_table(
+        "tasks",
+        "CREATE TABLE {table} ("
+        "task_id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, "
+        "name VARCHAR NOT NULL, "
+        "due_date DATE NOT NULL, "
+        "priority INTEGER NOT NULL, "
+        "posted_date DATE, "
+        "status INTEGER, "
+        "user_id INTEGER REFERENCES users (id))",
+        {
+            "task_id": "task_id",
+            "name": "name",
+            "due_date": "due_date",
+            "priority": "priority",
+            "posted_date": "posted_date",
+            "status": "status",
+            "user_id": "user_id",
+        },
+        indexes=[
+            "CREATE INDEX ix_tasks_due_date ON tasks (due_date)",
+            "CREATE INDEX ix_tasks_status_due_date "
+            "ON tasks (status, due_date)",
+            "CREATE INDEX ix_tasks_status_priority "
+            "ON tasks (status, priority)",
+            "CREATE INDEX ix_tasks_priority_due_date "
+            "ON tasks (priority, due_date)",
+            "CREATE INDEX ix_tasks_user_id_status_due_date "
+            "ON tasks (user_id, status, due_date)",
+        ],
+    )
+    m.execute(
+        "CREATE TABLE IF NOT EXISTS tasks_archive ("
+        "task_id INTEGER NOT NULL PRIMARY KEY, "
+        "name VARCHAR NOT NULL, "
+        "due_date DATE NOT NULL, "
+        "priority INTEGER NOT NULL, "
+        "posted_date DATE, "
+        "status INTEGER, "
+        "user_id INTEGER REFERENCES users (id), "
+        "archived_date DATETIME)"
+    )
+    m.create_index("ix_tasks_archive_due_date", "tasks_archive", "due_date")
+    # the rebuild dropped the triggers along with the old table; put them
+    # back and redo what they would have done for writes in between
+    with m.engine.begin() as conn:
+        for statement in CREATE_FTS + CREATE_TRIGGERS:
+            conn.execute(statement)
+        for statement in CREATE_ARCHIVE_TRIGGERS:
+            conn.execute(statement)
+        conn.execute(REBUILD_FTS)
+        rebuild_counts(conn)
+
+
+@migration("0008_api_tokens")
+def api_tokens(m):
+    m.execute(
+        "CREATE TABLE IF NOT EXISTS api_tokens ("
+        "id INTEGER NOT NULL PRIMARY KEY, "
+        "user_id INTEGER NOT NULL REFERENCES users (id), "
+        "name VARCHAR, "
+        "token_hash VARCHAR NOT NULL UNIQUE, "
+        "created DATETIME, "
+        "revoked DATETIME)"
+    )
+
+
+@migration("0009_task_list_indexes")
+def task_list_indexes(m):
+    # indexes ending in the api sort keys, for tasks and the archive
+    for table, columns in [
+        ("tasks", ("priority", "task_id")),
+        ("tasks", ("status", "task_id")),
+        ("tasks", ("user_id", "task_id")),
+        ("tasks", ("user_id", "due_date", "task_id")),
+        ("tasks", ("user_id", "priority", "task_id")),
+        ("tasks_archive", ("priority", "task_id")),
+        ("tasks_archive", ("priority", "due_date", "task_id")),
+        ("tasks_archive", ("user_id", "task_id")),
+        ("tasks_archive", ("user_id", "due_date", "task_id")),
+        ("tasks_archive", ("user_id", "priority", "task_id")),
+    ]:
+        m.create_index(f"ix_{table}_{'_'.join(columns)}", table, *columns)
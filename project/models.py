@@ -18,6 +18,33 @@ import datetime
 class Task(db.Model):
 
     __tablename__ = "tasks"
+    __table_args__ = (
+        db.Index("ix_tasks_due_date", "due_date"),
+        db.Index("ix_tasks_status_due_date", "status", "due_date"),
+        db.Index("ix_tasks_status_priority", "status", "priority"),
+        db.Index("ix_tasks_priority_due_date", "priority", "due_date"),
+        db.Index(
+            "ix_tasks_user_id_status_due_date", "user_id", "status", "due_date"
+        ),
+        # the api task list, read in (sort key, task_id) order
+        db.Index("ix_tasks_priority_task_id", "priority", "task_id"),
+        db.Index("ix_tasks_status_task_id", "status", "task_id"),
+        db.Index("ix_tasks_user_id_task_id", "user_id", "task_id"),
+        db.Index(
+            "ix_tasks_user_id_due_date_task_id",
+            "user_id",
+            "due_date",
+            "task_id",
+        ),
+        db.Index(
+            "ix_tasks_user_id_priority_task_id",
+            "user_id",
+            "priority",
+            "task_id",
+        ),
+        # ids of archived tasks must never be handed out again
+        {"sqlite_autoincrement": True},
+    )
 
     task_id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
@@ -39,6 +66,47 @@ class Task(db.Model):
         return f"<Task:: {self.name} {self.due_date} {self.status}>"
 
 
+class ArchivedTask(db.Model):
+
+    __tablename__ = "tasks_archive"
+    __table_args__ = (
+        db.Index("ix_tasks_archive_due_date", "due_date"),
+        db.Index("ix_tasks_archive_priority_task_id", "priority", "task_id"),
+        db.Index(
+            "ix_tasks_archive_priority_due_date_task_id",
+            "priority",
+            "due_date",
+            "task_id",
+        ),
+        db.Index("ix_tasks_archive_user_id_task_id", "user_id", "task_id"),
+        db.Index(
+            "ix_tasks_archive_user_id_due_date_task_id",
+            "user_id",
+            "due_date",
+            "task_id",
+        ),
+        db.Index(
+            "ix_tasks_archive_user_id_priority_task_id",
+            "user_id",
+            "priority",
+            "task_id",
+        ),
+    )
+
+    task_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String, nullable=False)
+    due_date = db.Column(db.Date, nullable=False)
+    priority = db.Column(db.Integer, nullable=False)
+    posted_date = db.Column(db.Date)
+    status = db.Column(db.Integer)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    archived_date = db.Column(db.DateTime)
+    poster = db.relationship("User")
+
+    def __repr__(self):
+        return f"<ArchivedTask:: {self.name} {self.due_date} {self.status}>"
+
+
 class User(db.Model):
 
     __tablename__ = "users"
@@ -58,3 +126,42 @@ class User(db.Model):
 
     def __repr__(self):
         return f"<User:: {self.name} {self.email} {self.role}>"
+
+
+class Version(db.Model):
+
+    __tablename__ = "versions"
+
+    name = db.Column(db.String, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    modified = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f"<Version:: {self.name} {self.version} {self.modified}>"
+
+
+class TaskCount(db.Model):
+
+    __tablename__ = "task_counts"
+
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    open = db.Column(db.Integer, nullable=False, default=0)
+    closed = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<TaskCount:: {self.user_id} {self.open} {self.closed}>"
+
+
+class ApiToken(db.Model):
+
+    __tablename__ = "api_tokens"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    name = db.Column(db.String)
+    token_hash = db.Column(db.String, unique=True, nullable=False)
+    created = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    revoked = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f"<ApiToken:: {self.id} {self.user_id} {self.name}>"
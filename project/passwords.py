@@ -0,0 +1,138 @@
+#! /usr/bin/env python3
+#
+################
+#
+# project/passwords.py
+#
+################
+#
+
+"""
+    Password hashing with a host-wide cap on how much of it runs at once.
+
+    bcrypt is deliberately slow, and a request that checks a password has
+    to wait for the answer wherever the hashing runs.  What keeps a burst
+    of logins from stalling the site is a limit on how many hashes run at
+    the same time across every worker on the host: PASSWORD_CONCURRENCY
+    slots (one per CPU by default), held as flock()ed files in
+    PASSWORD_LOCK_DIR.  The directory belongs to this copy of the app, so
+    staging, production and test runs on one host do not take each
+    other's slots.  A request waits at most PASSWORD_WAIT seconds for
+    a slot and is then turned away with a 503, so the serving threads are
+    freed for the rest of the site instead of queueing behind bcrypt.
+    bcrypt releases the GIL while it works, so the hash runs in the
+    request's own thread.
+
+    The work factor is BCRYPT_LOG_ROUNDS.  Hashes made with another cost
+    are replaced on the user's next successful login.
+"""
+
+import fcntl
+import os
+import random
+import time
+import bcrypt
+from werkzeug.exceptions import ServiceUnavailable
+
+
+class PasswordSlotsBusy(ServiceUnavailable):
+    description = "Too many sign-ins at once. Please try again in a moment."
+
+    def get_headers(self, environ=None):
+        return super().get_headers(environ) + [("Retry-After", "1")]
+
+
+def _bytes(value):
+    return value.encode("utf-8") if isinstance(value, str) else value
+
+
+# plain functions of their arguments, so the import's process pool can
+# run them as well
+def hash_password(password, rounds):
+    return bcrypt.hashpw(_bytes(password), bcrypt.gensalt(rounds)).decode()
+
+
+def check_password(pw_hash, password):
+    return bcrypt.checkpw(_bytes(password), _bytes(pw_hash))
+
+
+def cost(pw_hash):
+    """The work factor a bcrypt hash was made with."""
+    return int(_bytes(pw_hash).split(b"$")[2])
+
+
+class HostSlots(object):
+    """
+    At most ``count`` holders at a time across every process on the host.
+
+    Each slot is a lock file in ``directory``; flock() locks belong to the
+    open file, so threads of one process compete like separate processes,
+    and a crashed holder's slot is freed with its file descriptors.
+    """
+
+    def __init__(self, directory, count):
+        self.directory = directory
+        self.count = count
+
+    def acquire(self, timeout):
+        """Take a slot and return its file descriptor, or None on timeout."""
+        os.makedirs(self.directory, exist_ok=True)
+        deadline = time.monotonic() + timeout
+        while True:
+            for slot in random.sample(range(self.count), self.count):
+                path = os.path.join(self.directory, f"slot-{slot}.lock")
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except BlockingIOError:
+                    os.close(fd)
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.01)
+
+    def release(self, fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+class PasswordHasher(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("BCRYPT_LOG_ROUNDS", 12)
+        app.config.setdefault("PASSWORD_CONCURRENCY", None)
+        app.config.setdefault("PASSWORD_WAIT", 1)
+        # one set of slots per copy of the app, not per host
+        app.config.setdefault(
+            "PASSWORD_LOCK_DIR", os.path.join(app.instance_path, "passwords")
+        )
+        self.app = app
+
+    @property
+    def slots(self):
+        config = self.app.config
+        count = config["PASSWORD_CONCURRENCY"] or os.cpu_count() or 1
+        return HostSlots(config["PASSWORD_LOCK_DIR"], count)
+
+    def _run(self, f, *args):
+        slots = self.slots
+        fd = slots.acquire(self.app.config["PASSWORD_WAIT"])
+        if fd is None:
+            raise PasswordSlotsBusy()
+        try:
+            return f(*args)
+        finally:
+            slots.release(fd)
+
+    def hash(self, password):
+        rounds = self.app.config["BCRYPT_LOG_ROUNDS"]
+        return self._run(hash_password, password, rounds)
+
+    def check(self, pw_hash, password):
+        return self._run(check_password, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        return cost(pw_hash) != self.app.config["BCRYPT_LOG_ROUNDS"]
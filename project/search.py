@@ -0,0 +1,89 @@
+#! /usr/bin/env python3
+#
+################
+#
+# project/search.py
+#
+################
+#
+
+"""
+    Full-text search over task names.
+
+    ``tasks_fts`` is an FTS5 index whose content lives in ``tasks`` itself;
+    triggers on ``tasks`` keep it in step with every insert, update and
+    delete, whichever route (ORM, bulk statement, raw SQL) made the change.
+"""
+
+import click
+from sqlalchemy import DDL, event, table, column, text
+from project.models import Task
+
+CREATE_FTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5("
+    "name, content='tasks', content_rowid='task_id')",
+    "CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks "
+    "BEGIN INSERT INTO tasks_fts(rowid, name) "
+    "VALUES (new.task_id, new.name); END",
+    "CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks "
+    "BEGIN INSERT INTO tasks_fts(tasks_fts, rowid, name) "
+    "VALUES ('delete', old.task_id, old.name); END",
+    "CREATE TRIGGER IF NOT EXISTS tasks_fts_update "
+    "AFTER UPDATE OF task_id, name ON tasks "
+    "BEGIN INSERT INTO tasks_fts(tasks_fts, rowid, name) "
+    "VALUES ('delete', old.task_id, old.name); "
+    "INSERT INTO tasks_fts(rowid, name) VALUES (new.task_id, new.name); END",
+]
+
+DROP_FTS = "DROP TABLE IF EXISTS tasks_fts"
+
+REBUILD_FTS = "INSERT INTO tasks_fts(tasks_fts) VALUES ('rebuild')"
+
+tasks_fts = table("tasks_fts", column("rowid"), column("rank"))
+
+for statement in CREATE_FTS:
+    event.listen(
+        Task.__table__,
+        "after_create",
+        DDL(statement).execute_if(dialect="sqlite"),
+    )
+event.listen(
+    Task.__table__, "before_drop", DDL(DROP_FTS).execute_if(dialect="sqlite")
+)
+
+
+def match_expression(terms):
+    """
+    Turn free text into an FTS5 query: every word must prefix-match.
+
+    Each word is quoted, so FTS5 operators and punctuation in user input
+    are searched for literally instead of being parsed.
+    """
+    words = terms.split()
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+
+def search_tasks(query, terms):
+    """
+    Restrict ``query`` (anything selecting from Task) to tasks matching
+    ``terms``, best match first.  Returns None for an empty search.
+    """
+    expression = match_expression(terms)
+    if not expression:
+        return None
+    return (
+        query.join(tasks_fts, tasks_fts.c.rowid == Task.task_id)
+        .filter(text("tasks_fts MATCH :terms").bindparams(terms=expression))
+        .order_by(tasks_fts.c.rank, Task.task_id)
+    )
+
+
+def init_app(app, db):
+    @app.cli.command("search-rebuild")
+    def search_rebuild():
+        """Backfill the task search index from the tasks table."""
+        with db.engine.begin() as conn:
+            for statement in CREATE_FTS:
+                conn.execute(statement)
+            conn.execute(REBUILD_FTS)
+        click.echo("task search index rebuilt")
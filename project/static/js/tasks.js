@@ -0,0 +1,94 @@
+// tasks dashboard: load further pages of the task tables on demand
+$(function () {
+  $(".load-more").on("click", function () {
+    var button = $(this);
+    var url = button.data("url");
+    if (button.data("next")) {
+      url += "?cursor=" + encodeURIComponent(button.data("next"));
+    }
+    button.prop("disabled", true);
+    $.getJSON(url, function (page) {
+      $(button.data("target")).append(page.html);
+      button.data("next", page.next || "");
+      button.text(button.text().replace(/^Show/, "More"));
+      button.toggle(Boolean(page.next));
+    }).always(function () {
+      button.prop("disabled", false);
+    });
+  });
+});
+
+// task rows: patched in place after a change, whether it was made from
+// this page or arrives as a live task event
+$(function () {
+  if (typeof TASK_ROWS_URL === "undefined") {
+    return;
+  }
+
+  function refreshOpen() {
+    var table = $("#open-tasks");
+    $.getJSON(table.data("url"), function (page) {
+      table.html(page.html);
+      $(".load-more[data-target='#open-tasks']")
+        .data("next", page.next || "")
+        .toggle(Boolean(page.next));
+    });
+  }
+
+  function patchRows(taskIds) {
+    $.getJSON(TASK_ROWS_URL, $.param({ ids: taskIds }, true), function (data) {
+      var found = {};
+      $.each(data.rows, function (i, row) {
+        found[row.task_id] = true;
+        var current = $("#task-" + row.task_id);
+        var target = $(row.open ? "#open-tasks" : "#closed-tasks");
+        if (current.length && current.closest("tbody").is(target)) {
+          current.replaceWith(row.html);
+        } else {
+          current.remove();
+          if (row.open) {
+            target.prepend(row.html);
+          }
+        }
+      });
+      $.each(taskIds, function (i, taskId) {
+        if (!found[taskId]) {
+          $("#task-" + taskId).remove();
+        }
+      });
+    });
+  }
+
+  // complete and delete links run in the background and patch their own
+  // row, so they work without the event stream too
+  $(document).on("click", "a.task-action", function (event) {
+    event.preventDefault();
+    var taskId = $(this).closest("tr").attr("id").replace("task-", "");
+    $.getJSON(this.href, function (result) {
+      $("#task-messages").html(
+        $("<div class='alert alert-success'>").text(result.message)
+      );
+      patchRows([taskId]);
+    });
+  });
+
+  if (!window.EventSource || typeof TASK_EVENTS_URL === "undefined") {
+    return;
+  }
+
+  var source = new EventSource(TASK_EVENTS_URL);
+  $.each(["added", "updated", "completed", "deleted"], function (i, name) {
+    source.addEventListener(name, function (event) {
+      var taskIds = JSON.parse(event.data).task_ids;
+      if (taskIds) {
+        patchRows(taskIds);
+      } else {
+        refreshOpen();
+      }
+    });
+  });
+  source.addEventListener("reload", function () {
+    source.close();
+    window.location.reload();
+  });
+});
@@ -39,3 +39,7 @@ class AddTaskForm(FlaskForm):
         ],
     )
     status = IntegerField("Status")
+
+
+class SelectedTasksForm(FlaskForm):
+    """CSRF protection for the complete/delete selected actions."""
@@ -12,50 +12,201 @@
 """
 
 import datetime
-from functools import wraps
+from collections import namedtuple
 from flask import (
+    abort,
     flash,
+    get_template_attribute,
+    jsonify,
     redirect,
     render_template,
     request,
-    session,
     url_for,
     Blueprint,
+    Response,
 )
-from .forms import AddTaskForm
-from project import db
-from project.models import Task
+from .forms import AddTaskForm, SelectedTasksForm
+from sqlalchemy import tuple_
+from sqlalchemy.orm import joinedload
+from project import app, db, events
+from project.auth import current_user, is_admin, login_required
+from project.cache import LRUCache
+from project.changes import current_version, on_tasks_changed
+from project.counters import task_counts
+from project.models import ArchivedTask, Task
+from project.search import search_tasks
 
 # configuration
 tasks_blueprint = Blueprint("tasks", __name__)
 
+# rendered table rows, keyed on the tasks version they were rendered at
+fragments = LRUCache(
+    app.config["FRAGMENT_CACHE_SIZE"], app.config["FRAGMENT_CACHE_TTL"]
+)
+on_tasks_changed(fragments.clear)
 
-# helper functions
-def login_required(f):
-    @wraps(f)
-    def wrap(*args, **kwargs):
-        if "logged_in" in session:
-            return f(*args, **kwargs)
-        else:
-            flash("You need to login first.")
-            return redirect(url_for("users.login"))
-
-    return wrap
+TaskRow = namedtuple(
+    "TaskRow", ["task_id", "poster", "open", "archived", "cells"]
+)
 
 
+# helper functions
 def open_tasks():
     return (
         db.session.query(Task)
+        .options(joinedload(Task.poster))
         .filter_by(status="1")
-        .order_by(Task.due_date.asc())
+        .order_by(Task.due_date.asc(), Task.task_id.asc())
     )
 
 
 def closed_tasks():
     return (
         db.session.query(Task)
+        .options(joinedload(Task.poster))
         .filter_by(status="0")
-        .order_by(Task.due_date.asc())
+        .order_by(Task.due_date.asc(), Task.task_id.asc())
+    )
+
+
+def archived_tasks():
+    return (
+        db.session.query(ArchivedTask)
+        .options(joinedload(ArchivedTask.poster))
+        .order_by(ArchivedTask.due_date.asc(), ArchivedTask.task_id.asc())
+    )
+
+
+def owned_tasks(task_ids):
+    """
+    The tasks among ``task_ids`` the logged in user may modify.
+
+    Ownership is part of the WHERE clause, so an UPDATE or DELETE on this
+    query checks and writes in one statement and its rowcount says how
+    many tasks it was allowed to touch.
+    """
+    query = db.session.query(Task).filter(Task.task_id.in_(task_ids))
+    if not is_admin():
+        query = query.filter(Task.user_id == current_user().id)
+    return query
+
+
+def task_exists(task_id):
+    return db.session.query(
+        db.session.query(Task).filter_by(task_id=task_id).exists()
+    ).scalar()
+
+
+def selected_task_ids():
+    task_ids = set()
+    for value in request.form.getlist("task_ids"):
+        try:
+            task_ids.add(int(value))
+        except ValueError:
+            pass
+    return sorted(task_ids)
+
+
+# the queries behind each section, with the model each one selects
+SECTIONS = {
+    "open": [(open_tasks, Task)],
+    "closed": [(closed_tasks, Task), (archived_tasks, ArchivedTask)],
+}
+
+
+def task_page(section, cursor=None):
+    """
+    Return one page of a section's tasks and the cursor for the next one.
+
+    Pages follow the (due_date, task_id) order of the section and the
+    cursor names the last task shown, so each page is a bounded index range
+    rather than an ever larger OFFSET.  The closed section reads the hot
+    table and the archive the same way and merges the two.
+    """
+    if cursor:
+        try:
+            due_date, task_id = cursor.split("_")
+            due_date = datetime.datetime.strptime(due_date, "%Y-%m-%d").date()
+            task_id = int(task_id)
+        except ValueError:
+            abort(400)
+    size = app.config["TASKS_PAGE_SIZE"]
+    page = []
+    for tasks, model in SECTIONS[section]:
+        query = tasks()
+        if cursor:
+            query = query.filter(
+                tuple_(model.due_date, model.task_id)
+                > tuple_(due_date, task_id)
+            )
+        page.extend(query.limit(size + 1).all())
+    page.sort(key=lambda task: (task.due_date, task.task_id))
+    next_cursor = None
+    if len(page) > size:
+        page = page[:size]
+        next_cursor = f"{page[-1].due_date}_{page[-1].task_id}"
+    return page, next_cursor
+
+
+def make_rows(tasks):
+    task_cells = get_template_attribute("_task_cells.html", "task_cells")
+    return [
+        TaskRow(
+            task.task_id,
+            task.poster.name if task.poster else None,
+            int(task.status) == 1,
+            isinstance(task, ArchivedTask),
+            task_cells(task),
+        )
+        for task in tasks
+    ]
+
+
+def task_rows_page(section, cursor=None):
+    """
+    One page of a section as pre-rendered rows, served from the cache.
+
+    Everything but the action links is the same for every viewer, so the
+    data cells are rendered once per tasks version; the template only adds
+    the owner/admin dependent links around them on each request.
+    """
+    version, _ = current_version()
+    key = (section, cursor or "", version)
+    entry = fragments.get(key)
+    if entry is None:
+        page, next_cursor = task_page(section, cursor)
+        entry = (make_rows(page), next_cursor)
+        fragments.set(key, entry)
+    return entry
+
+
+def publish(event, task_ids):
+    """Tell every open dashboard which tasks changed, once committed."""
+    events.publish("tasks", event, task_ids=task_ids)
+
+
+def wants_json():
+    return request.accept_mimetypes.best == "application/json"
+
+
+def done(message):
+    """Back to the dashboard, or just the message for the dashboard's JS."""
+    if wants_json():
+        return jsonify(message=message)
+    flash(message)
+    return redirect(url_for("tasks.tasks"))
+
+
+def render_tasks(form, error=None):
+    """The dashboard: the first page of open tasks, closed ones on demand."""
+    rows, next_cursor = task_rows_page("open")
+    return render_template(
+        "tasks.html",
+        form=form,
+        error=error,
+        open_tasks=rows,
+        open_next=next_cursor,
+        counts=task_counts(current_user().id),
     )
 
 
@@ -63,12 +214,85 @@ def closed_tasks():
 @tasks_blueprint.route("/tasks")
 @login_required
 def tasks():
+    return render_tasks(AddTaskForm(request.form))
+
+
+@tasks_blueprint.route("/tasks/<any(open, closed):section>")
+@login_required
+def task_rows(section):
+    """Table rows for one more page of a section, for the dashboard JS."""
+    rows, next_cursor = task_rows_page(section, request.args.get("cursor"))
+    html = render_template("_task_rows.html", rows=rows)
+    return jsonify(html=html, next=next_cursor)
+
+
+@tasks_blueprint.route("/tasks/rows")
+@login_required
+def changed_rows():
+    """
+    The current rows of the tasks named by ``ids``, for patching the page.
+
+    Tasks that no longer exist are simply left out of the answer.
+    """
+    task_ids = request.args.getlist("ids", type=int)
+    tasks = (
+        db.session.query(Task)
+        .options(joinedload(Task.poster))
+        .filter(Task.task_id.in_(task_ids))
+        .all()
+    )
+    rows = [
+        {
+            "task_id": row.task_id,
+            "open": row.open,
+            "html": render_template("_task_rows.html", rows=[row]),
+        }
+        for row in make_rows(tasks)
+    ]
+    return jsonify(rows=rows)
+
+
+@tasks_blueprint.route("/tasks/events")
+@login_required
+def task_events():
+    """Server-Sent Events naming the tasks each committed write changed."""
+    stream = events.stream("tasks")
+    if stream is None:
+        # too many open streams: EventSource stops retrying on a 204
+        return "", 204
+    # not wrapped in stream_with_context: the request context, and with it
+    # the database session and its pooled connection, is let go before the
+    # first chunk goes out
+    return Response(
+        stream,
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@tasks_blueprint.route("/tasks/search")
+@login_required
+def search():
+    """Tasks whose name matches ``q``, best match first, a page at a time."""
+    terms = request.args.get("q", "")
+    page = request.args.get("page", 1, type=int)
+    if page < 1:
+        abort(400)
+    size = app.config["TASKS_PAGE_SIZE"]
+    rows, more = [], False
+    query = search_tasks(
+        db.session.query(Task).options(joinedload(Task.poster)), terms
+    )
+    if query is not None:
+        tasks = query.offset((page - 1) * size).limit(size + 1).all()
+        more = len(tasks) > size
+        rows = make_rows(tasks[:size])
     return render_template(
-        "tasks.html",
-        form=AddTaskForm(request.form),
-        open_tasks=open_tasks(),
-        closed_tasks=closed_tasks(),
-        username=session["name"],
+        "search.html",
+        terms=terms,
+        rows=rows,
+        page=page,
+        more=more,
     )
 
 
@@ -85,46 +309,79 @@ def new_task():
                 form.priority.data,
                 datetime.datetime.utcnow(),
                 "1",
-                session["user_id"],
+                current_user().id,
             )
             db.session.add(new_task)
             db.session.commit()
+            publish("added", [new_task.task_id])
             flash("New entry was successfully posted. Thanks.")
             return redirect(url_for("tasks.tasks"))
-    return render_template(
-        "tasks.html",
-        form=form,
-        error=error,
-        open_tasks=open_tasks(),
-        closed_tasks=closed_tasks(),
-    )
+    return render_tasks(form, error)
 
 
 @tasks_blueprint.route("/complete/<int:task_id>")
 @login_required
 def complete(task_id):
-    new_id = task_id
-    task = db.session.query(Task).filter_by(task_id=new_id)
-    if session["user_id"] == task.first().user_id or session["role"] == "admin":
-        task.update({"status": 0})
+    updated = owned_tasks([task_id]).update(
+        {"status": 0}, synchronize_session=False
+    )
+    if updated:
         db.session.commit()
-        flash("The task is complete. Nice.")
-        return redirect(url_for("tasks.tasks"))
+        publish("completed", [task_id])
+        return done("The task is complete. Nice.")
+    elif task_exists(task_id):
+        return done("You can only update tasks that belong to you.")
     else:
-        flash("You can only update tasks that belong to you.")
-        return redirect(url_for("tasks.tasks"))
+        return done("That task does not exist.")
 
 
 @tasks_blueprint.route("/delete/<int:task_id>")
 @login_required
 def delete_entry(task_id):
-    new_id = task_id
-    task = db.session.query(Task).filter_by(task_id=new_id)
-    if session["user_id"] == task.first().user_id or session["role"] == "admin":
-        task.delete()
+    deleted = owned_tasks([task_id]).delete(synchronize_session=False)
+    if deleted:
+        db.session.commit()
+        publish("deleted", [task_id])
+        return done("The task was deleted. Why not add a new one?")
+    elif task_exists(task_id):
+        return done("You can only delete tasks that belong to you.")
+    else:
+        return done("That task does not exist.")
+
+
+@tasks_blueprint.route("/complete", methods=["POST"])
+@login_required
+def complete_selected():
+    form = SelectedTasksForm(request.form)
+    task_ids = selected_task_ids()
+    if form.validate_on_submit() and task_ids:
+        updated = owned_tasks(task_ids).update(
+            {"status": 0}, synchronize_session=False
+        )
+        db.session.commit()
+        if updated:
+            publish("completed", task_ids)
+        flash(f"{updated} of {len(task_ids)} selected tasks completed.")
+        if updated < len(task_ids):
+            flash("You can only update tasks that belong to you.")
+    else:
+        flash("No tasks were selected.")
+    return redirect(url_for("tasks.tasks"))
+
+
+@tasks_blueprint.route("/delete", methods=["POST"])
+@login_required
+def delete_selected():
+    form = SelectedTasksForm(request.form)
+    task_ids = selected_task_ids()
+    if form.validate_on_submit() and task_ids:
+        deleted = owned_tasks(task_ids).delete(synchronize_session=False)
         db.session.commit()
-        flash("The task was deleted. Why not add a new one?")
-        return redirect(url_for("tasks.tasks"))
+        if deleted:
+            publish("deleted", task_ids)
+        flash(f"{deleted} of {len(task_ids)} selected tasks deleted.")
+        if deleted < len(task_ids):
+            flash("You can only delete tasks that belong to you.")
     else:
-        flash("You can only delete tasks that belong to you.")
-        return redirect(url_for("tasks.tasks"))
+        flash("No tasks were selected.")
+    return redirect(url_for("tasks.tasks"))
@@ -0,0 +1,71 @@
+#! /usr/bin/env python3
+#
+################
+#
+# project/templating.py
+#
+################
+#
+
+"""
+    Template compilation up front instead of on each worker's first hit.
+
+    Compiled templates are kept in a Jinja bytecode cache under
+    TEMPLATE_CACHE_DIR, which every worker on the host shares.  The
+    Procfile runs ``flask templates-compile`` to fill it before gunicorn
+    starts, on the same host; a worker then only unmarshals code that is
+    already compiled, and its first request renders as fast as any later
+    one.  TEMPLATE_PRECOMPILE also loads every
+    template at import time, which is off by default so that CLI commands
+    and test runs do not pay for it.
+
+    Workers write to the cache concurrently, so each file is written to a
+    temporary name and renamed into place: a reader sees either the old
+    file, the new one or none, never half of one.
+"""
+
+import os
+import tempfile
+import click
+from jinja2 import FileSystemBytecodeCache
+
+
+class AtomicBytecodeCache(FileSystemBytecodeCache):
+    """A FileSystemBytecodeCache that never exposes a half-written file."""
+
+    def dump_bytecode(self, bucket):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                bucket.write_bytecode(f)
+            os.replace(path, self._get_cache_filename(bucket))
+        except BaseException:
+            os.remove(path)
+            raise
+
+
+def precompile(app):
+    """Load every template into the environment, returning their names."""
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
+
+
+def init_app(app):
+    app.config.setdefault("TEMPLATE_CACHE_DIR", None)
+    app.config.setdefault("TEMPLATE_PRECOMPILE", False)
+
+    directory = app.config["TEMPLATE_CACHE_DIR"]
+    if directory:
+        # the directory is made on the first write, not at import time
+        app.jinja_env.bytecode_cache = AtomicBytecodeCache(
+            directory, "flasktaskr-%s.cache"
+        )
+
+    @app.cli.command("templates-compile")
+    def templates_compile():
+        """Compile every template into the bytecode cache."""
+        names = precompile(app)
+        click.echo(f"compiled {len(names)} templates")
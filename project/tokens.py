@@ -0,0 +1,98 @@
+#! /usr/bin/env python3
+#
+################
+#
+# project/tokens.py
+#
+################
+#
+
+"""
+    Bearer tokens for the API.
+
+    A token is a random string handed out once; only its SHA-256 digest is
+    stored.  Verified tokens are remembered in an in-process LRU for
+    API_TOKEN_CACHE_TTL seconds, so an authenticated request normally costs
+    one hash and a dictionary lookup.  Revoking a token drops it from this
+    process's cache at once; other workers stop accepting it when their
+    cached entry expires.
+"""
+
+import datetime
+import hashlib
+import secrets
+from collections import namedtuple
+import click
+from project import app, db
+from project.cache import LRUCache
+from project.models import ApiToken, User
+
+TokenUser = namedtuple("TokenUser", ["user_id", "name", "role", "token_id"])
+
+verified = LRUCache(
+    app.config["API_TOKEN_CACHE_SIZE"], app.config["API_TOKEN_CACHE_TTL"]
+)
+
+
+def digest(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def issue_token(user, name=None):
+    """Create a token for ``user`` and return it; it is not stored."""
+    token = secrets.token_urlsafe(32)
+    db.session.add(
+        ApiToken(user_id=user.id, name=name, token_hash=digest(token))
+    )
+    db.session.commit()
+    return token
+
+
+def verify_token(token):
+    """The TokenUser ``token`` authenticates, or None."""
+    key = digest(token)
+    user = verified.get(key)
+    if user is None:
+        row = (
+            db.session.query(ApiToken.id, User.id, User.name, User.role)
+            .join(User, User.id == ApiToken.user_id)
+            .filter(ApiToken.token_hash == key, ApiToken.revoked.is_(None))
+            .first()
+        )
+        if row is None:
+            return None
+        token_id, user_id, name, role = row
+        user = TokenUser(user_id, name, role, token_id)
+        verified.set(key, user)
+    return user
+
+
+def revoke_token(token_id):
+    """Revoke a token, returning False if there is no such live token."""
+    token = db.session.query(ApiToken).get(token_id)
+    if token is None or token.revoked is not None:
+        return False
+    token.revoked = datetime.datetime.utcnow()
+    db.session.commit()
+    verified.delete(token.token_hash)
+    return True
+
+
+def init_app(app, db):
+    @app.cli.command("api-token-issue")
+    @click.argument("username")
+    @click.option("--name", default=None, help="What the token is for.")
+    def api_token_issue(username, name):
+        """Issue an API token for USERNAME and print it."""
+        user = User.query.filter_by(name=username).first()
+        if user is None:
+            raise click.ClickException(f"No user named {username}")
+        click.echo(issue_token(user, name))
+
+    @app.cli.command("api-token-revoke")
+    @click.argument("token_id", type=int)
+    def api_token_revoke(token_id):
+        """Revoke the API token with id TOKEN_ID."""
+        if not revoke_token(token_id):
+            raise click.ClickException(f"No live token with id {token_id}")
+        click.echo(f"revoked token {token_id}")
@@ -11,46 +11,29 @@
     routes for the user appliction of flask_taskr
 """
 
-from functools import wraps
 from flask import (
     flash,
     redirect,
     render_template,
     request,
-    session,
     url_for,
     Blueprint,
 )
 from sqlalchemy.exc import IntegrityError
 from .forms import RegisterForm, LoginForm
-from project import db, bcrypt
+from project import db, passwords
+from project.auth import login_required, login_user, logout_user
 from project.models import User
 
 # config
 users_blueprint = Blueprint("users", __name__)
 
 
-# helper functions
-def login_required(f):
-    @wraps(f)
-    def wrap(*args, **kwargs):
-        if "logged_in" in session:
-            return f(*args, **kwargs)
-        else:
-            flash("You need to login first.")
-            return redirect(url_for("users.login"))
-
-    return wrap
-
-
 # routes
 @users_blueprint.route("/logout")
 @login_required
 def logout():
-    session.pop("logged_in", None)
-    session.pop("user_id", None)
-    session.pop("role", None)
-    session.pop("name", None)
+    logout_user()
     flash("Goodbye!")
     return redirect(url_for("users.login"))
 
@@ -62,13 +45,12 @@ def login():
     if request.method == "POST":
         if form.validate_on_submit():
             user = User.query.filter_by(name=request.form["name"]).first()
-            if user is not None and bcrypt.check_password_hash(
-                user.password, request.form["password"]
-            ):
-                session["logged_in"] = True
-                session["user_id"] = user.id
-                session["role"] = user.role
-                session["name"] = user.name
+            password = request.form["password"]
+            if user is not None and passwords.check(user.password, password):
+                if passwords.needs_rehash(user.password):
+                    user.password = passwords.hash(password)
+                    db.session.commit()
+                login_user(user)
                 flash("Welcome!")
                 return redirect(url_for("tasks.tasks"))
             else:
@@ -85,7 +67,7 @@ def register():
             new_user = User(
                 form.name.data,
                 form.email.data,
-                bcrypt.generate_password_hash(form.password.data),
+                passwords.hash(form.password.data),
             )
             try:
                 db.session.add(new_user)
@@ -12,11 +12,22 @@ docstring goes here.  be sure to write a good one ;)
 """
 
 
+import json
+import shutil
+import tempfile
 import unittest
-from datetime import date
+from datetime import date, datetime, timedelta
+from itertools import combinations
+from sqlalchemy import event
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import http_date
 
-from project import app, db
-from project.models import Task
+from project import app, db, bcrypt, cache
+from project.api.views import encode_cursor, filter_tasks, sort_tasks
+from project.api.serializers import task_rows
+from project.archive import archive_tasks
+from project.models import ArchivedTask, Task, User, Version
+from project.tokens import issue_token, revoke_token, verified
 
 
 class APITests(unittest.TestCase):
@@ -25,13 +36,22 @@ class APITests(unittest.TestCase):
         app.config["WTF_CRF_ENABLED"] = False
         app.config["DEBUG"] = False
         app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+        # password slots of our own, not those of other runs on the host
+        self.lock_dir = app.config["PASSWORD_LOCK_DIR"]
+        app.config["PASSWORD_LOCK_DIR"] = tempfile.mkdtemp()
         self.app = app.test_client()
         db.create_all()
+        cache.clear()
+        verified.clear()
+        self.token = self.api_client_token()
+        self.authorize(self.token)
         self.assertEquals(app.debug, False)
 
     def tearDown(self):
         db.session.remove()
         db.drop_all()
+        shutil.rmtree(app.config["PASSWORD_LOCK_DIR"])
+        app.config["PASSWORD_LOCK_DIR"] = self.lock_dir
 
     def add_tasks(self):
         db.session.add(
@@ -58,6 +78,45 @@ class APITests(unittest.TestCase):
         )
         db.session.commit()
 
+    def api_client_token(self):
+        # a machine client, kept out of the way of the ids tests rely on
+        client = User(
+            name="apiClient", email="api@realpython.com", password="unused"
+        )
+        client.id = 100
+        db.session.add(client)
+        db.session.commit()
+        return issue_token(client, "tests")
+
+    def authorize(self, token):
+        if token is None:
+            self.app.environ_base.pop("HTTP_AUTHORIZATION", None)
+        else:
+            self.app.environ_base["HTTP_AUTHORIZATION"] = "Bearer " + token
+
+    def login(self, name, password):
+        # act as the logged in user rather than the token's owner
+        self.authorize(None)
+        user = User(
+            name=name,
+            email=name + "@realpython.com",
+            password=bcrypt.generate_password_hash(password),
+        )
+        # number users from 1 as if the api client were not there
+        user.id = User.query.filter(User.id < 100).count() + 1
+        db.session.add(user)
+        db.session.commit()
+        return self.app.post(
+            "/", data=dict(name=name, password=password), follow_redirects=True
+        )
+
+    def bulk(self, operations):
+        return self.app.post(
+            "api/v1/tasks/bulk",
+            data=json.dumps({"operations": operations}),
+            content_type="application/json",
+        )
+
     def test_collection_endpoint_returns_correct_data(self):
         self.add_tasks()
         response = self.app.get("api/v1/tasks", follow_redirects=True)
@@ -81,5 +140,473 @@ class APITests(unittest.TestCase):
         self.assertEquals(response.mimetype, "application/json")
         self.assertIn(b"Element does not exist", response.data)
 
+    def test_collection_endpoint_pages_with_cursor(self):
+        for i in range(5):
+            self.add_tasks()
+        response = self.app.get("api/v1/tasks?limit=4")
+        page = json.loads(response.data)
+        self.assertEquals(len(page["item"]), 4)
+        self.assertIsNotNone(page["next"])
+        seen = [t["task_id"] for t in page["item"]]
+        while page["next"]:
+            response = self.app.get(
+                "api/v1/tasks?limit=4&cursor=" + page["next"]
+            )
+            self.assertEquals(response.status_code, 200)
+            page = json.loads(response.data)
+            seen.extend(t["task_id"] for t in page["item"])
+        self.assertEquals(seen, list(range(1, 11)))
+
+    def test_collection_endpoint_rejects_bad_cursor(self):
+        response = self.app.get("api/v1/tasks?cursor=not-a-cursor")
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(response.mimetype, "application/json")
+        response = self.app.get("api/v1/tasks?limit=0")
+        self.assertEquals(response.status_code, 400)
+
+    def test_export_endpoint_streams_ndjson(self):
+        self.add_tasks()
+        response = self.app.get("api/v1/tasks/export")
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.mimetype, "application/x-ndjson")
+        lines = response.data.decode("utf-8").splitlines()
+        self.assertEquals(len(lines), 2)
+        self.assertEquals(json.loads(lines[1])["task name"],
+                          "Purchase Real Python")
+
+    def test_export_endpoint_streams_csv(self):
+        self.add_tasks()
+        response = self.app.get("api/v1/tasks/export?format=csv")
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.mimetype, "text/csv")
+        lines = response.data.decode("utf-8").splitlines()
+        self.assertEquals(lines[0].split(",")[0], "task_id")
+        self.assertIn("Run around in circles", lines[1])
+        self.assertEquals(len(lines), 3)
+
+    def test_collection_endpoint_answers_if_none_match(self):
+        self.add_tasks()
+        response = self.app.get("api/v1/tasks")
+        etag = response.headers["ETag"]
+        response = self.app.get(
+            "api/v1/tasks", headers={"If-None-Match": etag}
+        )
+        self.assertEquals(response.status_code, 304)
+        self.assertEquals(response.data, b"")
+
+    def test_last_modified_is_withheld_within_the_same_second(self):
+        self.add_tasks()
+        now = datetime.utcnow().replace(microsecond=0)
+
+        def written(at):
+            db.session.query(Version).update({"modified": at})
+            db.session.commit()
+            cache.clear()
+
+        # a write that is still in the current second
+        written(now + timedelta(seconds=5))
+        response = self.app.get("api/v1/tasks/1")
+        self.assertIsNone(response.headers.get("Last-Modified"))
+        response = self.app.get(
+            "api/v1/tasks/1",
+            headers={"If-Modified-Since": http_date(now + timedelta(1))},
+        )
+        self.assertEquals(response.status_code, 200)
+        # once the write is in the past the date can be trusted
+        written(now - timedelta(seconds=2))
+        response = self.app.get("api/v1/tasks/1")
+        since = response.headers["Last-Modified"]
+        response = self.app.get(
+            "api/v1/tasks/1", headers={"If-Modified-Since": since}
+        )
+        self.assertEquals(response.status_code, 304)
+
+    def test_etag_changes_when_tasks_change(self):
+        self.add_tasks()
+        etag = self.app.get("api/v1/tasks/1").headers["ETag"]
+        db.session.query(Task).filter_by(task_id=1).update({"status": 0})
+        db.session.commit()
+        response = self.app.get(
+            "api/v1/tasks/1", headers={"If-None-Match": etag}
+        )
+        self.assertEquals(response.status_code, 200)
+        self.assertNotEquals(response.headers["ETag"], etag)
+
+    def test_bulk_endpoint_requires_login(self):
+        self.authorize(None)
+        response = self.bulk([{"op": "complete", "task_id": 1}])
+        self.assertEquals(response.status_code, 401)
+
+    def test_api_requires_a_valid_token(self):
+        self.add_tasks()
+        self.authorize(None)
+        response = self.app.get("api/v1/tasks/1")
+        self.assertEquals(response.status_code, 401)
+        self.assertEquals(response.headers["WWW-Authenticate"], "Bearer")
+        self.authorize("not-a-token")
+        response = self.app.get("api/v1/tasks/1")
+        self.assertEquals(response.status_code, 401)
+        self.authorize(self.token)
+        response = self.app.get("api/v1/tasks/1")
+        self.assertEquals(response.status_code, 200)
+
+    def test_verified_tokens_skip_the_database_until_revoked(self):
+        self.app.get("api/v1/tasks")
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            self.app.get("api/v1/cache/stats")
+        finally:
+            event.remove(
+                db.engine, "before_cursor_execute", before_cursor_execute
+            )
+        self.assertFalse(any("api_tokens" in s for s in statements))
+        self.assertTrue(revoke_token(1))
+        response = self.app.get("api/v1/cache/stats")
+        self.assertEquals(response.status_code, 401)
+
+    def test_bulk_endpoint_acts_as_the_token_owner(self):
+        self.add_tasks()
+        response = self.bulk([{"op": "complete", "task_id": 1}])
+        self.assertEquals(response.status_code, 403)
+        response = self.bulk(
+            [
+                {
+                    "op": "create",
+                    "name": "Robot chore",
+                    "due_date": "2020-01-01",
+                    "priority": 1,
+                }
+            ]
+        )
+        self.assertEquals(response.status_code, 200)
+        task = Task.query.filter_by(name="Robot chore").one()
+        self.assertEquals(task.user_id, 100)
+
+    def test_bulk_endpoint_applies_all_operations(self):
+        app.config["WTF_CSRF_ENABLED"] = False
+        self.login("newGuy", "passwordOne")
+        self.add_tasks()
+        self.add_tasks()
+        operations = [
+            {
+                "op": "create",
+                "name": "Task %d" % i,
+                "due_date": "2019-01-30",
+                "priority": 1,
+            }
+            for i in range(100)
+        ]
+        operations += [
+            {"op": "update", "task_id": 1, "name": "Walk in a line"},
+            {"op": "complete", "task_id": 2},
+            {"op": "delete", "task_id": 3},
+        ]
+        response = self.bulk(operations)
+        self.assertEquals(response.status_code, 200)
+        result = json.loads(response.data)
+        self.assertEquals(
+            result,
+            {"created": 100, "updated": 1, "completed": 1, "deleted": 1},
+        )
+        self.assertEquals(Task.query.count(), 103)
+        self.assertEquals(Task.query.get(1).name, "Walk in a line")
+        self.assertEquals(Task.query.get(2).status, 0)
+
+    def test_bulk_endpoint_rejects_tasks_of_other_users(self):
+        app.config["WTF_CSRF_ENABLED"] = False
+        self.add_tasks()
+        self.login("newGuy", "passwordOne")
+        self.app.get("/logout")
+        self.login("newGuy2", "passwordOne")
+        response = self.bulk(
+            [
+                {"op": "complete", "task_id": 1},
+                {"op": "delete", "task_id": 42},
+            ]
+        )
+        self.assertEquals(response.status_code, 403)
+        self.assertEquals(len(json.loads(response.data)["errors"]), 2)
+        self.assertEquals(Task.query.get(1).status, 1)
+
+    def test_bulk_endpoint_validates_operations(self):
+        app.config["WTF_CSRF_ENABLED"] = False
+        self.login("newGuy", "passwordOne")
+        response = self.bulk(
+            [{"op": "create", "name": "No date", "priority": 1}]
+        )
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(Task.query.count(), 0)
+        response = self.app.post(
+            "api/v1/tasks/bulk",
+            data=json.dumps([{"op": "complete", "task_id": 1}]),
+            content_type="application/json",
+        )
+        self.assertEquals(response.status_code, 400)
+        self.add_tasks()
+        response = self.bulk(
+            [
+                {"op": "delete", "task_id": 1},
+                {"op": "update", "task_id": 1, "name": "Gone already"},
+            ]
+        )
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(
+            json.loads(response.data)["errors"],
+            [{"index": 1, "error": "Only one operation per task"}],
+        )
+        self.assertEquals(Task.query.count(), 2)
+
+    def test_collection_endpoint_filters_tasks(self):
+        self.add_tasks()
+        db.session.query(Task).filter_by(task_id=1).update({"status": 0})
+        db.session.commit()
+        response = self.app.get("api/v1/tasks?status=1&user_id=1")
+        self.assertIn(b"Purchase Real Python", response.data)
+        self.assertNotIn(b"Run around in circles", response.data)
+        response = self.app.get("api/v1/tasks?due_before=2015-12-31")
+        self.assertIn(b"Run around in circles", response.data)
+        self.assertNotIn(b"Purchase Real Python", response.data)
+        response = self.app.get("api/v1/tasks?status=open")
+        self.assertEquals(response.status_code, 400)
+
+    def test_collection_endpoint_pages_in_sort_order(self):
+        for i in range(3):
+            self.add_tasks()
+        response = self.app.get("api/v1/tasks?sort=-due_date&limit=2")
+        page = json.loads(response.data)
+        seen = [t["task_id"] for t in page["item"]]
+        while page["next"]:
+            response = self.app.get(
+                "api/v1/tasks?sort=-due_date&limit=2&cursor=" + page["next"]
+            )
+            page = json.loads(response.data)
+            seen.extend(t["task_id"] for t in page["item"])
+        self.assertEquals(seen, [6, 4, 2, 5, 3, 1])
+
+    def test_every_filter_combination_uses_an_index(self):
+        filters = {
+            "status": "0",
+            "priority": "3",
+            "user_id": "1",
+            "due_after": "2019-01-01",
+            "due_before": "2019-12-31",
+        }
+        cursors = {
+            "task_id": [5],
+            "due_date": ["2019-06-01", 5],
+            "priority": [3, 5],
+        }
+        for model in (Task, ArchivedTask):
+            for sort in ("task_id", "due_date", "priority", "-priority"):
+                for n in range(len(filters) + 1):
+                    for names in combinations(filters, n):
+                        args = MultiDict({k: filters[k] for k in names})
+                        args["sort"] = sort
+                        self.assertUsesIndex(model, args, (names, sort))
+                        # deep pages start from the cursor with a search
+                        cursor = cursors[sort.lstrip("-")]
+                        if "priority" in names and "priority" in sort:
+                            cursor = cursor[1:]
+                        args["cursor"] = encode_cursor(cursor)
+                        plan = self.assertUsesIndex(model, args, (names, sort))
+                        for row in plan:
+                            self.assertNotIn("SCAN", row, (names, sort))
+
+    def test_pages_sorted_by_a_filtered_column(self):
+        for i in range(3):
+            self.add_tasks()
+        seen, cursor = [], ""
+        while cursor is not None:
+            response = self.app.get(
+                "api/v1/tasks?priority=10&sort=-priority&limit=2&cursor="
+                + cursor
+            )
+            page = json.loads(response.data)
+            seen.extend(t["task_id"] for t in page["item"])
+            cursor = page["next"]
+        self.assertEquals(seen, [6, 5, 4, 3, 2, 1])
+
+    def assertUsesIndex(self, model, args, msg):
+        query, _ = sort_tasks(
+            filter_tasks(task_rows(model), args, model), args, model
+        )
+        compiled = query.statement.compile(db.engine)
+        plan = [
+            row[-1]
+            for row in db.engine.execute(
+                "EXPLAIN QUERY PLAN " + str(compiled),
+                *[compiled.params[k] for k in compiled.positiontup]
+            )
+        ]
+        for row in plan:
+            self.assertNotIn("TEMP B-TREE", row, msg)
+        return plan
+
+    def test_read_routes_are_served_from_cache(self):
+        self.add_tasks()
+        before = cache.stats()
+        first = self.app.get("api/v1/tasks/1")
+        second = self.app.get("api/v1/tasks/1")
+        after = cache.stats()
+        self.assertEquals(first.data, second.data)
+        self.assertEquals(first.headers["ETag"], second.headers["ETag"])
+        self.assertEquals(after["misses"] - before["misses"], 1)
+        self.assertEquals(after["hits"] - before["hits"], 1)
+        response = self.app.get(
+            "api/v1/tasks/1", headers={"If-None-Match": first.headers["ETag"]}
+        )
+        self.assertEquals(response.status_code, 304)
+
+    def test_cache_is_invalidated_when_a_task_is_completed(self):
+        app.config["WTF_CSRF_ENABLED"] = False
+        self.login("newGuy", "passwordOne")
+        self.add_tasks()
+        response = self.app.get("api/v1/tasks/1")
+        self.assertEquals(json.loads(response.data)["status"], 1)
+        self.app.get("/complete/1")
+        response = self.app.get("api/v1/tasks/1")
+        self.assertEquals(json.loads(response.data)["status"], 0)
+
+    def test_entries_stored_after_a_commit_are_not_served(self):
+        self.add_tasks()
+        self.app.get("api/v1/tasks/1")
+        stale = list(cache.backend._data.items())
+        Task.query.get(1).status = 0
+        db.session.commit()
+        # a miss computed before the commit, stored after its clear()
+        for key, (_, entry) in stale:
+            cache.backend.set(key, entry)
+        response = self.app.get("api/v1/tasks/1")
+        self.assertEquals(json.loads(response.data)["status"], 0)
+
+    def test_cache_stats_endpoint(self):
+        response = self.app.get("api/v1/cache/stats")
+        self.assertEquals(response.status_code, 403)
+        self.assertEquals(response.mimetype, "application/json")
+        self.assertIn("error", json.loads(response.data))
+        admin = User(
+            name="apiAdmin",
+            email="admin@realpython.com",
+            password="unused",
+            role="admin",
+        )
+        admin.id = 101
+        db.session.add(admin)
+        db.session.commit()
+        self.authorize(issue_token(admin))
+        response = self.app.get("api/v1/cache/stats")
+        self.assertEquals(response.status_code, 200)
+        self.assertIn("hits", json.loads(response.data))
+
+    def test_search_endpoint_ranks_and_pages_matches(self):
+        self.add_tasks()
+        for name in ("Python course", "Python, python and more python"):
+            db.session.add(
+                Task(name, date(2016, 3, 1), 5, date(2016, 2, 1), 1, 1)
+            )
+        db.session.commit()
+        response = self.app.get("api/v1/tasks/search?q=python&limit=2")
+        data = json.loads(response.data)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(
+            data["item"][0]["task name"], "Python, python and more python"
+        )
+        self.assertEquals(data["next"], 2)
+        response = self.app.get("api/v1/tasks/search?q=python&limit=2&page=2")
+        data = json.loads(response.data)
+        self.assertEquals(len(data["item"]), 1)
+        self.assertIsNone(data["next"])
+
+    def test_search_endpoint_follows_renames_and_quotes_input(self):
+        self.add_tasks()
+        task = db.session.query(Task).get(1)
+        task.name = "Walk in squares"
+        db.session.commit()
+        response = self.app.get("api/v1/tasks/search?q=circles")
+        self.assertEquals(json.loads(response.data)["item"], [])
+        response = self.app.get('api/v1/tasks/search?q=squares"+OR')
+        self.assertEquals(response.status_code, 200)
+        response = self.app.get("api/v1/tasks/search")
+        self.assertEquals(response.status_code, 400)
+
+    def test_counts_endpoint_follows_task_writes(self):
+        self.add_tasks()
+        db.session.add(Task("Later", date(2999, 1, 1), 1, date.today(), 1, 1))
+        db.session.add(Task("Other", date(2999, 1, 1), 1, date.today(), 1, 2))
+        db.session.commit()
+        response = self.app.get("api/v1/users/1/counts")
+        self.assertEquals(
+            json.loads(response.data), {"open": 3, "closed": 0, "overdue": 2}
+        )
+        db.session.query(Task).filter_by(task_id=1).update({"status": 0})
+        db.session.query(Task).filter_by(task_id=2).delete()
+        db.session.query(Task).filter_by(task_id=4).update({"user_id": 1})
+        db.session.commit()
+        response = self.app.get("api/v1/users/1/counts")
+        self.assertEquals(
+            json.loads(response.data), {"open": 2, "closed": 1, "overdue": 0}
+        )
+        response = self.app.get("api/v1/users/2/counts")
+        self.assertEquals(json.loads(response.data)["open"], 0)
+
+    def test_counts_rebuild_command_recounts_tasks(self):
+        self.add_tasks()
+        db.session.execute("UPDATE task_counts SET open = 99, closed = 7")
+        db.session.commit()
+        result = app.test_cli_runner().invoke(args=["counts-rebuild"])
+        self.assertIn("task counts rebuilt", result.output)
+        response = self.app.get("api/v1/users/1/counts")
+        data = json.loads(response.data)
+        self.assertEquals((data["open"], data["closed"]), (2, 0))
+
+    def test_resource_endpoint_reads_archived_tasks(self):
+        self.add_tasks()
+        db.session.query(Task).filter_by(task_id=1).update({"status": 0})
+        db.session.commit()
+        archive_tasks(date(2016, 1, 1))
+        self.assertIsNone(db.session.query(Task).get(1))
+        response = self.app.get("api/v1/tasks/1")
+        data = json.loads(response.data)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(data["task name"], "Run around in circles")
+        self.assertEquals(data["status"], 0)
+
+    def test_collection_and_export_endpoints_include_archived_tasks(self):
+        for i in range(3):
+            self.add_tasks()
+        db.session.query(Task).filter(Task.task_id.in_([1, 3])).update(
+            {"status": 0}, synchronize_session=False
+        )
+        db.session.commit()
+        archive_tasks(date(2016, 1, 1))
+        self.assertEquals(Task.query.count(), 4)
+        response = self.app.get("api/v1/tasks?status=0")
+        ids = [t["task_id"] for t in json.loads(response.data)["item"]]
+        self.assertEquals(ids, [1, 3])
+        response = self.app.get("api/v1/tasks?status=1")
+        ids = [t["task_id"] for t in json.loads(response.data)["item"]]
+        self.assertEquals(ids, [2, 4, 5, 6])
+        # pages merge both tables in sort order
+        seen, cursor = [], ""
+        while cursor is not None:
+            response = self.app.get(
+                "api/v1/tasks?sort=-due_date&limit=2&cursor=" + cursor
+            )
+            page = json.loads(response.data)
+            seen.extend(t["task_id"] for t in page["item"])
+            cursor = page["next"]
+        self.assertEquals(seen, [6, 4, 2, 5, 3, 1])
+        response = self.app.get("api/v1/tasks/export")
+        lines = response.data.decode("utf-8").splitlines()
+        self.assertEquals(
+            [json.loads(line)["task_id"] for line in lines], [1, 2, 3, 4, 5, 6]
+        )
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,217 @@
+#! /usr/bin/env python3
+#
+################
+#
+# tests/test_asgi.py
+#
+################
+#
+
+"""
+    Runs the API tests again through the ASGI front end.
+"""
+
+import asyncio
+import threading
+import time
+import unittest
+from urllib.parse import urlencode, urlsplit
+
+from werkzeug.datastructures import Headers
+
+import test_api
+from project import app, events
+from project.asgi import ASGIAdapter
+
+application = ASGIAdapter(
+    app, api_threads=4, html_threads=2, stream_threads=2
+)
+
+
+class ASGIResponse(object):
+    def __init__(self, status, headers, data):
+        self.status_code = status
+        self.headers = headers
+        self.data = data
+        self.mimetype = headers.get("Content-Type", "").split(";")[0]
+
+
+class ASGIClient(object):
+    """Just enough of the Flask test client, spoken over ASGI."""
+
+    def __init__(self, application):
+        self.application = application
+        self.cookies = {}
+        self.environ_base = {}
+
+    def get(self, path, **kwargs):
+        return self.open("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.open("POST", path, **kwargs)
+
+    def open(self, method, path, data=b"", content_type=None, headers=None,
+             follow_redirects=False, disconnect_after=None):
+        if isinstance(data, dict):
+            data = urlencode(data)
+            content_type = "application/x-www-form-urlencoded"
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        path, _, query = path.partition("?")
+        raw_headers = [(b"host", b"localhost")]
+        for key, value in self.environ_base.items():
+            if key.startswith("HTTP_"):
+                name = key[5:].replace("_", "-").lower()
+                raw_headers.append((name.encode(), value.encode()))
+        for name, value in (headers or {}).items():
+            raw_headers.append((name.lower().encode(), value.encode()))
+        if content_type:
+            raw_headers.append((b"content-type", content_type.encode()))
+            raw_headers.append(
+                (b"content-length", str(len(data)).encode())
+            )
+        if self.cookies:
+            cookie = "; ".join("%s=%s" % c for c in self.cookies.items())
+            raw_headers.append((b"cookie", cookie.encode()))
+        scope = {
+            "type": "http",
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": "/" + path.lstrip("/"),
+            "root_path": "",
+            "query_string": query.encode(),
+            "headers": raw_headers,
+            "server": ("localhost", 80),
+            "client": ("127.0.0.1", 1234),
+        }
+        messages = []
+        requested = []
+
+        async def receive():
+            if not requested:
+                requested.append(True)
+                return {
+                    "type": "http.request", "body": data, "more_body": False
+                }
+            # like a server, say nothing more until the client goes away
+            if disconnect_after is None:
+                await asyncio.Event().wait()
+            await asyncio.sleep(disconnect_after)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            messages.append(message)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.application(scope, receive, send))
+        finally:
+            loop.close()
+
+        headers = Headers(
+            [(k.decode(), v.decode()) for k, v in messages[0]["headers"]]
+        )
+        for cookie in headers.getlist("Set-Cookie"):
+            name, _, value = cookie.split(";")[0].partition("=")
+            self.cookies[name] = value
+        response = ASGIResponse(
+            messages[0]["status"],
+            headers,
+            b"".join(m.get("body", b"") for m in messages[1:]),
+        )
+        if follow_redirects and response.status_code in (301, 302, 303):
+            return self.get(urlsplit(headers["Location"]).path,
+                            follow_redirects=True)
+        return response
+
+
+class ASGIAPITests(test_api.APITests):
+    def setUp(self):
+        super(ASGIAPITests, self).setUp()
+        self.app = ASGIClient(application)
+        self.authorize(self.token)
+
+    def test_slow_api_readers_do_not_block_html_routes(self):
+        release = threading.Event()
+        busy = [
+            application.api_pool.submit(release.wait, 10) for _ in range(4)
+        ]
+        try:
+            response = self.app.get("/")
+            self.assertEquals(response.status_code, 200)
+        finally:
+            release.set()
+        for future in busy:
+            future.result()
+
+    def test_event_streams_do_not_take_html_threads(self):
+        self.login("michael", "python")
+        release = threading.Event()
+        busy = [
+            application.html_pool.submit(release.wait, 10) for _ in range(2)
+        ]
+        app.config["EVENTS_STREAM_TIMEOUT"] = 0
+        try:
+            response = self.app.get("/tasks/events")
+            self.assertEquals(response.status_code, 200)
+            self.assertEquals(response.data, b"retry: 3000\n\n")
+        finally:
+            app.config["EVENTS_STREAM_TIMEOUT"] = 300
+            release.set()
+        for future in busy:
+            future.result()
+
+    def test_event_streams_end_when_the_client_leaves(self):
+        self.login("michael", "python")
+        app.config["EVENTS_KEEPALIVE"] = 0.1
+        start = time.monotonic()
+        try:
+            response = self.app.get("/tasks/events", disconnect_after=0.5)
+        finally:
+            app.config["EVENTS_KEEPALIVE"] = 15
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertIn(b"retry: 3000", response.data)
+        self.assertEquals(len(events.broker), 0)
+        # every slot is free again
+        streams = [
+            events.stream("tasks")
+            for _ in range(app.config["EVENTS_MAX_STREAMS"])
+        ]
+        for stream in streams:
+            self.assertIsNotNone(stream)
+            stream.close()
+
+    def test_threads_stop_writing_once_nobody_reads(self):
+        closed = threading.Event()
+
+        class Endless(object):
+            def __iter__(self):
+                while True:
+                    yield b"chunk"
+
+            def close(self):
+                closed.set()
+
+        def endless(environ, start_response):
+            start_response("200 OK", [])
+            return Endless()
+
+        adapter = ASGIAdapter(endless)
+        # a loop that never runs, like one whose request was cancelled
+        loop = asyncio.new_event_loop()
+        gone = threading.Event()
+        thread = threading.Thread(
+            target=adapter.run_wsgi,
+            args=({}, loop, asyncio.Queue(), threading.Semaphore(1), gone),
+        )
+        thread.start()
+        gone.set()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(closed.is_set())
+        loop.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
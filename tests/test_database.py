@@ -0,0 +1,237 @@
+#! /usr/bin/env python3
+#
+################
+#
+# tests/test_database.py
+#
+################
+#
+
+"""
+    SQLite engine settings, exercised by parallel readers and writers on a
+    throwaway database file.
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+from datetime import date
+
+from project import app, bcrypt, db
+from project.models import Task, User
+
+
+class DatabaseTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        app.config["TESTING"] = True
+        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(
+            self.tmpdir, "concurrency.db"
+        )
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.engine.dispose()
+        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+        shutil.rmtree(self.tmpdir)
+
+    def pragma(self, name):
+        with db.engine.connect() as conn:
+            return conn.execute(f"PRAGMA {name}").scalar()
+
+    def test_connections_get_the_configured_pragmas(self):
+        self.assertEquals(self.pragma("journal_mode"), "wal")
+        self.assertEquals(self.pragma("synchronous"), 1)
+        self.assertEquals(
+            self.pragma("busy_timeout"), app.config["SQLITE_BUSY_TIMEOUT"]
+        )
+        self.assertEquals(
+            self.pragma("cache_size"), app.config["SQLITE_CACHE_SIZE"]
+        )
+        self.assertEquals(
+            db.engine.pool.size(), app.config["SQLALCHEMY_POOL_SIZE"]
+        )
+
+    def test_parallel_readers_and_writers(self):
+        writers, readers, writes = 4, 4, 25
+        errors = []
+        done = threading.Event()
+
+        def write(worker):
+            try:
+                with app.app_context():
+                    for i in range(writes):
+                        db.session.add(
+                            Task(
+                                f"Task {worker}-{i}",
+                                date(2019, 1, 30),
+                                1,
+                                date(2019, 1, 1),
+                                i % 2,
+                                worker,
+                            )
+                        )
+                        db.session.commit()
+                    db.session.remove()
+            except Exception as e:  # pragma: no cover
+                errors.append(e)
+
+        def read():
+            try:
+                with app.app_context():
+                    while not done.is_set():
+                        Task.query.filter_by(status=1).count()
+                        db.session.rollback()
+                    db.session.remove()
+            except Exception as e:  # pragma: no cover
+                errors.append(e)
+
+        threads = [threading.Thread(target=read) for _ in range(readers)]
+        writer_threads = [
+            threading.Thread(target=write, args=(worker,))
+            for worker in range(1, writers + 1)
+        ]
+        for thread in threads + writer_threads:
+            thread.start()
+        for thread in writer_threads:
+            thread.join()
+        done.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(errors, [])
+        self.assertEquals(Task.query.count(), writers * writes)
+        with db.engine.connect() as conn:
+            rows = conn.execute(
+                "SELECT user_id, open, closed FROM task_counts "
+                "ORDER BY user_id"
+            ).fetchall()
+        self.assertEquals(
+            [tuple(row) for row in rows],
+            [(worker, 12, 13) for worker in range(1, writers + 1)],
+        )
+
+
+class ReplicaTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.primary = os.path.join(self.tmpdir, "primary.db")
+        self.replica = os.path.join(self.tmpdir, "replica.db")
+        app.config["TESTING"] = True
+        app.config["WTF_CSRF_ENABLED"] = False
+        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + self.primary
+        self.lock_dir = app.config["PASSWORD_LOCK_DIR"]
+        app.config["PASSWORD_LOCK_DIR"] = os.path.join(self.tmpdir, "slots")
+        db.create_all()
+        password = bcrypt.generate_password_hash("python")
+        db.session.add(
+            User("michael", "michael@realpython.com", password, "user")
+        )
+        db.session.add(
+            Task("Replicated", date(2019, 1, 30), 1, date(2019, 1, 1), 1, 1)
+        )
+        db.session.commit()
+        db.session.remove()
+        self.replicate()
+        app.config["SQLALCHEMY_REPLICA_URIS"] = ["sqlite:///" + self.replica]
+
+    def tearDown(self):
+        db.session.remove()
+        app.config["SQLALCHEMY_REPLICA_URIS"] = []
+        db.get_replica_engines()
+        db.engine.dispose()
+        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+        app.config["PASSWORD_LOCK_DIR"] = self.lock_dir
+        shutil.rmtree(self.tmpdir)
+
+    def replicate(self):
+        source = sqlite3.connect(self.primary)
+        target = sqlite3.connect(self.replica)
+        source.backup(target)
+        target.close()
+        source.close()
+
+    def write_to_primary(self, name):
+        # a write the replica has not caught up with yet
+        with db.engine.begin() as conn:
+            conn.execute(
+                "INSERT INTO tasks (name, due_date, priority, posted_date, "
+                "status, user_id) VALUES (?, '2019-01-30', 1, '2019-01-01', "
+                "1, 1)",
+                (name,),
+            )
+
+    def names(self):
+        return {task.name for task in Task.query}
+
+    def test_reads_go_to_the_replica(self):
+        self.write_to_primary("Lagging")
+        self.assertEquals(self.names(), {"Replicated"})
+        db.session.remove()
+        self.replicate()
+        self.assertEquals(self.names(), {"Replicated", "Lagging"})
+
+    def test_writes_go_to_the_primary_and_stick(self):
+        task = Task("Written", date(2019, 1, 30), 1, date(2019, 1, 1), 1, 1)
+        db.session.add(task)
+        db.session.flush()
+        self.assertEquals(self.names(), {"Replicated", "Written"})
+        db.session.commit()
+        self.assertEquals(self.names(), {"Replicated", "Written"})
+        with sqlite3.connect(self.replica) as conn:
+            rows = conn.execute("SELECT name FROM tasks").fetchall()
+        self.assertEquals(rows, [("Replicated",)])
+        # once the sticky window is over reads go back to the replica
+        db.session.info["sticky_until"] = 0
+        self.assertEquals(self.names(), {"Replicated"})
+
+    def test_core_writes_stick_too(self):
+        db.session.execute(
+            Task.__table__.insert().values(
+                name="Core",
+                due_date=date(2019, 1, 30),
+                priority=1,
+                posted_date=date(2019, 1, 1),
+                status=1,
+                user_id=1,
+            )
+        )
+        db.session.commit()
+        self.assertEquals(self.names(), {"Replicated", "Core"})
+
+    def test_rollback_does_not_stick(self):
+        db.session.add(
+            Task("Dropped", date(2019, 1, 30), 1, date(2019, 1, 1), 1, 1)
+        )
+        db.session.flush()
+        db.session.rollback()
+        self.write_to_primary("Lagging")
+        self.assertEquals(self.names(), {"Replicated"})
+
+    def test_browser_reads_its_own_writes_after_redirect(self):
+        client = app.test_client()
+        client.post("/", data=dict(name="michael", password="python"))
+        response = client.post(
+            "/add",
+            data=dict(
+                name="Fresh task",
+                due_date="10/08/2019",
+                priority="1",
+                posted_date="10/08/2019",
+                status="1",
+            ),
+            follow_redirects=True,
+        )
+        self.assertIn(b"Fresh task", response.data)
+        # another browser still reads from the replica
+        other = app.test_client()
+        other.post("/", data=dict(name="michael", password="python"))
+        self.assertNotIn(b"Fresh task", other.get("/tasks").data)
+
+
+if __name__ == "__main__":
+    unittest.main()
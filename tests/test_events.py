@@ -0,0 +1,74 @@
+#! /usr/bin/env python3
+#
+################
+#
+# tests/test_events.py
+#
+################
+#
+
+"""
+    Tests for the in-process event broker and the event streams.
+"""
+
+import unittest
+
+from flask import Flask
+
+from project.events import Events, LocalBroker
+
+
+class LocalBrokerTests(unittest.TestCase):
+    def test_messages_reach_every_subscriber_of_the_channel(self):
+        broker = LocalBroker()
+        first = broker.subscribe("tasks")
+        second = broker.subscribe("tasks")
+        other = broker.subscribe("users")
+        broker.publish("tasks", "hello")
+        self.assertEquals(first.get(0), "hello")
+        self.assertEquals(second.get(0), "hello")
+        self.assertIsNone(other.get(0))
+
+    def test_closed_subscriptions_are_forgotten(self):
+        broker = LocalBroker()
+        subscription = broker.subscribe("tasks")
+        self.assertEquals(len(broker), 1)
+        subscription.close()
+        self.assertEquals(len(broker), 0)
+        broker.publish("tasks", "hello")
+        self.assertIsNone(subscription.get(0))
+
+    def test_slow_subscribers_are_flagged_instead_of_blocking(self):
+        broker = LocalBroker(queue_size=2)
+        subscription = broker.subscribe("tasks")
+        for i in range(3):
+            broker.publish("tasks", i)
+        self.assertTrue(subscription.lagged)
+        self.assertEquals(subscription.get(0), 0)
+
+
+class EventStreamTests(unittest.TestCase):
+    def setUp(self):
+        app = Flask(__name__)
+        app.config["EVENTS_MAX_STREAMS"] = 2
+        self.events = Events(app)
+
+    def test_streams_past_the_limit_are_refused(self):
+        first = self.events.stream("tasks")
+        second = self.events.stream("tasks")
+        self.assertEquals(next(first), "retry: 3000\n\n")
+        self.assertIsNone(self.events.stream("tasks"))
+        first.close()
+        first.close()
+        third = self.events.stream("tasks")
+        self.assertIsNotNone(third)
+        self.assertIsNone(self.events.stream("tasks"))
+        # a stream that was never read from still gives its slot back
+        second.close()
+        third.close()
+        self.assertEquals(len(self.events.broker), 0)
+        self.assertIsNotNone(self.events.stream("tasks"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -11,9 +11,16 @@
     Custom error pages.
 """
 
+import gzip
+import os
+import shutil
+import tempfile
 import unittest
 
-from project import app, db
+from flask import url_for
+from jinja2 import FileSystemBytecodeCache
+
+from project import app, db, templating
 from project.models import User
 
 
@@ -25,6 +32,9 @@ class MainTests(unittest.TestCase):
         app.config["WTF_CSRF_ENABLED"] = False
         app.config["DEBUG"] = False
         app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+        # password slots of our own, not those of other runs on the host
+        self.lock_dir = app.config["PASSWORD_LOCK_DIR"]
+        app.config["PASSWORD_LOCK_DIR"] = tempfile.mkdtemp()
         self.app = app.test_client()
         db.create_all()
         self.assertEquals(app.debug, False)
@@ -32,6 +42,8 @@ class MainTests(unittest.TestCase):
     def tearDown(self):
         db.session.remove()
         db.drop_all()
+        shutil.rmtree(app.config["PASSWORD_LOCK_DIR"])
+        app.config["PASSWORD_LOCK_DIR"] = self.lock_dir
 
     # Helper Methods
     def login(self, name, password):
@@ -63,5 +75,81 @@ class MainTests(unittest.TestCase):
         response = self.app.get("/", content_type="html/text")
         self.assertEqual(response.status_code, 200)
 
+    def test_large_pages_are_gzipped_when_accepted(self):
+        response = self.app.get(
+            "/register", headers={"Accept-Encoding": "gzip"}
+        )
+        self.assertEquals(response.headers["Content-Encoding"], "gzip")
+        self.assertIn(b"Please register", gzip.decompress(response.data))
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        response = self.app.get("/register")
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_static_urls_are_fingerprinted_and_cached(self):
+        with app.test_request_context():
+            url = url_for("static", filename="css/main.css")
+        self.assertIn("?v=", url)
+        response = self.app.get(url)
+        self.assertEquals(response.status_code, 200)
+        self.assertIn("immutable", response.headers["Cache-Control"])
+        response.close()
+
+    def test_precompressed_static_files_are_served(self):
+        path = os.path.join(app.static_folder, "css", "main.css")
+        with open(path, "rb") as f:
+            data = f.read()
+        with open(path + ".gz", "wb") as f:
+            f.write(gzip.compress(data))
+        try:
+            response = self.app.get(
+                "/static/css/main.css", headers={"Accept-Encoding": "gzip"}
+            )
+            self.assertEquals(response.headers["Content-Encoding"], "gzip")
+            self.assertEquals(response.mimetype, "text/css")
+            self.assertEquals(gzip.decompress(response.data), data)
+            response.close()
+        finally:
+            os.remove(path + ".gz")
+
+    def test_precompile_fills_the_bytecode_cache(self):
+        directory = tempfile.mkdtemp()
+        env = app.jinja_env
+        saved = env.bytecode_cache
+        try:
+            env.bytecode_cache = FileSystemBytecodeCache(directory)
+            env.cache.clear()
+            names = templating.precompile(app)
+            self.assertIn("tasks.html", names)
+            self.assertEquals(len(os.listdir(directory)), len(names))
+            # a fresh worker loads the compiled code instead of compiling
+            env.cache.clear()
+            env.compile = None
+            self.assertEquals(len(templating.precompile(app)), len(names))
+        finally:
+            del env.compile
+            env.bytecode_cache = saved
+            env.cache.clear()
+            shutil.rmtree(directory)
+
+    def test_bytecode_cache_files_appear_whole(self):
+        self.assertFalse(app.config["TEMPLATE_PRECOMPILE"])
+        self.assertIsInstance(
+            app.jinja_env.bytecode_cache, templating.AtomicBytecodeCache
+        )
+        directory = os.path.join(tempfile.mkdtemp(), "cache")
+        try:
+            bcc = templating.AtomicBytecodeCache(directory)
+            source = "{{ 1 + 1 }}"
+            bucket = bcc.get_bucket(app.jinja_env, "t.html", None, source)
+            bucket.code = app.jinja_env.compile(source, "t.html")
+            bcc.set_bucket(bucket)
+            # only the final file: the temporary one was renamed into place
+            filename = os.path.basename(bcc._get_cache_filename(bucket))
+            self.assertEquals(os.listdir(directory), [filename])
+            loaded = bcc.get_bucket(app.jinja_env, "t.html", None, source)
+            self.assertIsNotNone(loaded.code)
+        finally:
+            shutil.rmtree(os.path.dirname(directory))
+
 if __name__ == "__main__":
     unittest.main()
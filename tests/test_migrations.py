@@ -0,0 +1,165 @@
+#! /usr/bin/env python3
+#
+################
+#
+# tests/test_migrations.py
+#
+################
+#
+
+"""
+    Schema migration tests, run against a throwaway SQLite file.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+
+from project.migrations import (
+    MIGRATIONS,
+    Migrator,
+    applied_revisions,
+    upgrade,
+)
+
+
+class MigrationTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        path = os.path.join(self.tmpdir, "migrate.db")
+        self.engine = create_engine("sqlite:///" + path)
+        # the schema as it was before users had a role
+        self.engine.execute(
+            "CREATE TABLE users (id INTEGER NOT NULL PRIMARY KEY, "
+            "name VARCHAR NOT NULL UNIQUE, email VARCHAR NOT NULL UNIQUE, "
+            "password VARCHAR NOT NULL)"
+        )
+        for i in range(1, 26):
+            self.engine.execute(
+                "INSERT INTO users (id, name, email, password) "
+                "VALUES (?, ?, ?, ?)",
+                (i, "user%d" % i, "user%d@email.com" % i, "secret"),
+            )
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def indexes(self, table):
+        rows = self.engine.execute(f"PRAGMA index_list({table})")
+        return {row[1] for row in rows}
+
+    def test_upgrade_applies_every_migration_once(self):
+        ran = upgrade(self.engine, chunk_size=7)
+        self.assertEquals(ran, [revision for revision, _ in MIGRATIONS])
+        self.assertEquals(applied_revisions(self.engine), set(ran))
+        self.assertEquals(upgrade(self.engine), [])
+
+    def test_upgrade_adds_role_and_keeps_users(self):
+        upgrade(self.engine, chunk_size=7)
+        rows = self.engine.execute(
+            "SELECT id, name, role FROM users ORDER BY id"
+        ).fetchall()
+        self.assertEquals(len(rows), 25)
+        self.assertEquals(tuple(rows[4]), (5, "user5", "user"))
+
+    def test_upgrade_adds_task_indexes(self):
+        upgrade(self.engine)
+        indexes = self.indexes("tasks")
+        self.assertIn("ix_tasks_status_due_date", indexes)
+        self.assertIn("ix_tasks_user_id_status_due_date", indexes)
+        self.assertIn("ix_tasks_priority_task_id", indexes)
+        self.assertIn(
+            "ix_tasks_archive_user_id_due_date_task_id",
+            self.indexes("tasks_archive"),
+        )
+
+    def test_upgrade_builds_task_search_index(self):
+        upgrade(self.engine)
+        self.engine.execute(
+            "INSERT INTO tasks (name, due_date, priority, posted_date, "
+            "status, user_id) VALUES ('Buy milk', '2020-01-01', 1, "
+            "'2020-01-01', 1, 1)"
+        )
+        rows = self.engine.execute(
+            "SELECT rowid FROM tasks_fts WHERE tasks_fts MATCH 'milk'"
+        ).fetchall()
+        self.assertEquals([tuple(row) for row in rows], [(1,)])
+
+    def test_upgrade_counts_existing_tasks(self):
+        upgrade(self.engine)
+        self.engine.execute(
+            "INSERT INTO tasks (name, due_date, priority, posted_date, "
+            "status, user_id) VALUES ('Buy milk', '2020-01-01', 1, "
+            "'2020-01-01', 0, 3)"
+        )
+        rows = self.engine.execute(
+            "SELECT user_id, open, closed FROM task_counts"
+        ).fetchall()
+        self.assertEquals([tuple(row) for row in rows], [(3, 0, 1)])
+
+    def test_upgrade_adds_archive_and_stops_reusing_task_ids(self):
+        upgrade(self.engine)
+        self.assertIn("tasks_archive", self.engine.table_names())
+        insert = (
+            "INSERT INTO tasks (name, due_date, priority, posted_date, "
+            "status, user_id) VALUES ('Buy milk', '2020-01-01', 1, "
+            "'2020-01-01', 1, 1)"
+        )
+        self.engine.execute(insert)
+        self.engine.execute("DELETE FROM tasks")
+        self.engine.execute(insert)
+        rows = self.engine.execute("SELECT task_id FROM tasks").fetchall()
+        self.assertEquals([tuple(row) for row in rows], [(2,)])
+
+    def test_rebuild_copies_in_chunks_and_keeps_concurrent_writes(self):
+        chunks = []
+
+        def progress(table, copied):
+            chunks.append(copied)
+            if len(chunks) == 1:
+                # writes landing between chunks, on both sides of the cursor
+                self.engine.execute(
+                    "UPDATE users SET name = 'renamed' || id "
+                    "WHERE id IN (2, 20)"
+                )
+                self.engine.execute("DELETE FROM users WHERE id IN (3, 21)")
+                self.engine.execute(
+                    "INSERT INTO users (id, name, email, password) "
+                    "VALUES (26, 'late', 'late@email.com', 'secret')"
+                )
+
+        Migrator(self.engine, chunk_size=10, progress=progress).rebuild_table(
+            "users",
+            "CREATE TABLE {table} (id INTEGER NOT NULL PRIMARY KEY, "
+            "name VARCHAR NOT NULL UNIQUE, email VARCHAR NOT NULL UNIQUE, "
+            "password VARCHAR NOT NULL, role VARCHAR)",
+            {
+                "id": "id",
+                "name": "name",
+                "email": "email",
+                "password": "password",
+                "role": "'user'",
+            },
+            indexes=["CREATE INDEX ix_users_role ON users (role)"],
+        )
+        self.assertEquals(chunks[0], 10)
+        rows = dict(
+            tuple(row)
+            for row in self.engine.execute("SELECT id, name FROM users")
+        )
+        self.assertEquals(len(rows), 24)
+        self.assertEquals(rows[2], "renamed2")
+        self.assertEquals(rows[20], "renamed20")
+        self.assertNotIn(3, rows)
+        self.assertNotIn(21, rows)
+        self.assertEquals(rows[26], "late")
+        self.assertIn("ix_users_role", self.indexes("users"))
+        self.assertNotIn("_new_users", self.engine.table_names())
+
+
+if __name__ == "__main__":
+    unittest.main()
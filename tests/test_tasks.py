@@ -11,10 +11,19 @@
     Unit Tests
 """
 
+import json
+import shutil
+import tempfile
 import unittest
+from datetime import date
+
+from sqlalchemy import event
 
 from project import app, db, bcrypt
-from project.models import User
+from project.archive import archive_tasks
+from project.counters import overdue_counts
+from project.models import ArchivedTask, Task, User
+from project.tasks.views import fragments
 
 TEST_DB = "test.db"
 
@@ -34,6 +43,9 @@ class AllTests(unittest.TestCase):
         #     basedir, TEST_DB
         # )
         app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+        # password slots of our own, not those of other runs on the host
+        self.lock_dir = app.config["PASSWORD_LOCK_DIR"]
+        app.config["PASSWORD_LOCK_DIR"] = tempfile.mkdtemp()
         self.app = app.test_client()
         db.create_all()
         self.assertEquals(app.debug, False)
@@ -42,6 +54,8 @@ class AllTests(unittest.TestCase):
     def tearDown(self):
         db.session.remove()
         db.drop_all()
+        shutil.rmtree(app.config["PASSWORD_LOCK_DIR"])
+        app.config["PASSWORD_LOCK_DIR"] = self.lock_dir
 
     #
     # Helper functions
@@ -214,6 +228,282 @@ class AllTests(unittest.TestCase):
         self.assertIn(b"/complete/2", response.data)
         self.assertIn(b"/delete/2", response.data)
 
+    def get_recording_queries(self, path):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            response = self.app.get(path)
+        finally:
+            event.remove(
+                db.engine, "before_cursor_execute", before_cursor_execute
+            )
+        self.assertEquals(response.status_code, 200)
+        return response, statements
+
+    def count_queries(self, path):
+        fragments.clear()
+        overdue_counts.clear()
+        return len(self.get_recording_queries(path)[1])
+
+    def test_tasks_page_query_count_does_not_grow_with_tasks(self):
+        self.create_user("newGuy", "newGuy@realpython.com", "passwordOne")
+        self.create_user("newGuy2", "newGuy2@realpython.com", "passwordOne")
+        self.login("newGuy", "passwordOne")
+        self.create_task()
+        baseline = self.count_queries("/tasks")
+        for i in range(10):
+            db.session.add(
+                Task("Task %d" % i, date(2019, 1, 30), 1, date(2019, 1, 1),
+                     i % 2, 1 + i % 2)
+            )
+        db.session.commit()
+        self.assertEquals(self.count_queries("/tasks"), baseline)
+
+    def test_tasks_page_renders_first_page_of_open_tasks_only(self):
+        self.create_user("newGuy", "newGuy@realpython.com", "passwordOne")
+        self.login("newGuy", "passwordOne")
+        for i in range(30):
+            db.session.add(
+                Task("Open task %d" % i, date(2019, 1, 30), 1,
+                     date(2019, 1, 1), 1, 1)
+            )
+        db.session.add(
+            Task("Finished chore", date(2019, 1, 30), 1, date(2019, 1, 1),
+                 0, 1)
+        )
+        db.session.commit()
+        response = self.app.get("/tasks")
+        self.assertIn(b"Open task 24<", response.data)
+        self.assertNotIn(b"Open task 25<", response.data)
+        self.assertNotIn(b"Finished chore", response.data)
+
+        response = self.app.get("/tasks/open?cursor=2019-01-30_25")
+        page = json.loads(response.data)
+        self.assertIn("Open task 25<", page["html"])
+        self.assertIn("Open task 29<", page["html"])
+        self.assertIsNone(page["next"])
+
+        response = self.app.get("/tasks/closed")
+        page = json.loads(response.data)
+        self.assertIn("Finished chore", page["html"])
+        self.assertNotIn("Mark as Complete", page["html"])
+
+    def test_task_rows_rejects_bad_cursor(self):
+        self.create_user("newGuy", "newGuy@realpython.com", "passwordOne")
+        self.login("newGuy", "passwordOne")
+        response = self.app.get("/tasks/open?cursor=yesterday")
+        self.assertEquals(response.status_code, 400)
+
+    def test_task_tables_are_cached_between_tasks_writes(self):
+        self.create_user("newGuy", "newGuy@realpython.com", "passwordOne")
+        self.login("newGuy", "passwordOne")
+        self.create_task()
+        cold = self.count_queries("/tasks")
+        response, statements = self.get_recording_queries("/tasks")
+        self.assertLess(len(statements), cold)
+        # only the overdue count still reads tasks, never the rows
+        self.assertEquals(
+            [s for s in statements if "FROM tasks" in s and "count(" not in s],
+            [],
+        )
+        self.assertIn(b"/complete/1", response.data)
+        self.logout()
+        self.create_user("newGuy2", "newGuy2@realpython.com", "passwordOne")
+        self.login("newGuy2", "passwordOne")
+        response = self.app.get("/tasks")
+        self.assertIn(b"Go to the bank", response.data)
+        self.assertNotIn(b"/complete/1", response.data)
+
+    def test_completing_missing_task_does_not_crash(self):
+        self.create_user("newGuy", "newGuy@realpython.com", "passwordOne")
+        self.login("newGuy", "passwordOne")
+        response = self.app.get("/complete/42", follow_redirects=True)
+        self.assertIn(b"That task does not exist.", response.data)
+        response = self.app.get("/delete/42", follow_redirects=True)
+        self.assertIn(b"That task does not exist.", response.data)
+
+    def test_users_can_complete_selected_tasks(self):
+        self.create_user("newGuy", "newGuy@realpython.com", "passwordOne")
+        self.login("newGuy", "passwordOne")
+        for i in range(3):
+            self.create_task()
+        self.logout()
+        self.create_user("newGuy2", "newGuy2@realpython.com", "passwordOne")
+        self.login("newGuy2", "passwordOne")
+        self.create_task()
+        response = self.app.post(
+            "/complete",
+            data=dict(task_ids=["1", "2", "4"]),
+            follow_redirects=True,
+        )
+        self.assertIn(b"1 of 3 selected tasks completed.", response.data)
+        self.assertIn(
+            b"You can only update tasks that belong to you.", response.data
+        )
+        self.assertEquals(
+            [t.status for t in Task.query.order_by(Task.task_id)],
+            [1, 1, 1, 0],
+        )
+
+    def test_admin_can_delete_selected_tasks(self):
+        self.create_user("newGuy", "newGuy@realpython.com", "passwordOne")
+        self.login("newGuy", "passwordOne")
+        for i in range(3):
+            self.create_task()
+        self.logout()
+        self.create_admin_user()
+        self.login("root", "passwordOne")
+        response = self.app.post(
+            "/delete", data=dict(task_ids=["1", "3"]), follow_redirects=True
+        )
+        self.assertIn(b"2 of 2 selected tasks deleted.", response.data)
+        self.assertEquals([t.task_id for t in Task.query.all()], [2])
+
+    def test_tasks_page_shows_task_counts(self):
+        self.create_user("newGuy", "newGuy@realpython.com", "passwordOne")
+        self.login("newGuy", "passwordOne")
+        for i in range(3):
+            self.create_task()
+        self.app.get("/complete/2")
+        response = self.app.get("/tasks")
+        self.assertIn(b"You have 2 open tasks (2 overdue)", response.data)
+        self.assertIn(b"and 1 closed tasks.", response.data)
+
+    def test_overdue_count_is_taken_once_per_tasks_version(self):
+        self.create_user("newGuy", "newGuy@realpython.com", "passwordOne")
+        self.login("newGuy", "passwordOne")
+        for i in range(3):
+            self.create_task()
+
+        def overdue_queries():
+            response, statements = self.get_recording_queries("/tasks")
+            counts = [s for s in statements if "due_date <" in s]
+            return response, len(counts)
+
+        overdue_counts.clear()
+        response, queries = overdue_queries()
+        self.assertIn(b"(3 overdue)", response.data)
+        self.assertEquals(queries, 1)
+        response, queries = overdue_queries()
+        self.assertIn(b"(3 overdue)", response.data)
+        self.assertEquals(queries, 0)
+        self.app.get("/complete/2")
+        response, queries = overdue_queries()
+        self.assertIn(b"(2 overdue)", response.data)
+        self.assertEquals(queries, 1)
+
+    def test_closed_section_includes_archived_tasks(self):
+        self.create_user("newGuy", "newGuy@realpython.com", "passwordOne")
+        self.login("newGuy", "passwordOne")
+        for i in range(4):
+            db.session.add(
+                Task("Chore %d" % i, date(2019, 1, 30 - i), 1,
+                     date(2019, 1, 1), i % 2, 1)
+            )
+        db.session.commit()
+        self.assertEquals(archive_tasks(date(2019, 1, 31), batch_size=1), 2)
+        self.assertEquals(
+            [t.task_id for t in ArchivedTask.query.order_by("task_id")], [1, 3]
+        )
+        self.assertEquals(Task.query.filter_by(status=0).count(), 0)
+        response = self.app.get("/tasks/closed")
+        page = json.loads(response.data)
+        self.assertLess(
+            page["html"].index("Chore 2"), page["html"].index("Chore 0")
+        )
+        self.assertIn("Archived", page["html"])
+        response = self.app.get("/tasks")
+        self.assertIn(b"and 2 closed tasks.", response.data)
+        # the archived ids are never handed out again
+        db.session.query(Task).filter_by(task_id=4).delete()
+        db.session.commit()
+        self.create_task()
+        self.assertEquals(
+            Task.query.filter_by(name="Go to the bank").one().task_id, 5
+        )
+
+    def test_write_routes_publish_task_events(self):
+        self.create_user("newGuy", "newGuy@realpython.com", "passwordOne")
+        self.login("newGuy", "passwordOne")
+        app.config["EVENTS_KEEPALIVE"] = 0.1
+        try:
+            response = self.app.get("/tasks/events", buffered=False)
+            self.assertEquals(response.mimetype, "text/event-stream")
+            stream = iter(response.response)
+            self.assertEquals(next(stream), b"retry: 3000\n\n")
+            # the stream does not keep the request's session checked out
+            self.assertFalse(db.session.registry.has())
+            self.create_task()
+            self.assertEquals(
+                next(stream), b'event: added\ndata: {"task_ids": [1]}\n\n'
+            )
+            self.app.get("/delete/1")
+            self.assertIn(b"event: deleted", next(stream))
+            self.assertEquals(next(stream), b": keepalive\n\n")
+            response.close()
+        finally:
+            app.config["EVENTS_KEEPALIVE"] = 15
+
+    def test_event_streams_past_the_limit_get_no_content(self):
+        self.create_user("newGuy", "newGuy@realpython.com", "passwordOne")
+        self.login("newGuy", "passwordOne")
+        limit = app.config["EVENTS_MAX_STREAMS"]
+        streams = [
+            self.app.get("/tasks/events", buffered=False)
+            for _ in range(limit)
+        ]
+        try:
+            response = self.app.get("/tasks/events")
+            self.assertEquals(response.status_code, 204)
+        finally:
+            for stream in streams:
+                stream.close()
+        response = self.app.get("/tasks/events", buffered=False)
+        self.assertEquals(response.status_code, 200)
+        response.close()
+
+    def test_task_links_answer_json_for_the_dashboard(self):
+        self.create_user("newGuy", "newGuy@realpython.com", "passwordOne")
+        self.login("newGuy", "passwordOne")
+        self.create_task()
+        self.create_task()
+        response = self.app.get(
+            "/complete/1", headers={"Accept": "application/json"}
+        )
+        self.assertEquals(
+            json.loads(response.data)["message"], "The task is complete. Nice."
+        )
+        response = self.app.get("/tasks/rows?ids=1&ids=2&ids=3")
+        rows = json.loads(response.data)["rows"]
+        self.assertEquals(
+            [(row["task_id"], row["open"]) for row in rows],
+            [(1, False), (2, True)],
+        )
+        self.assertIn('id="task-2"', rows[1]["html"])
+
+    def test_users_can_search_tasks(self):
+        self.create_user("newGuy", "newGuy@realpython.com", "passwordOne")
+        self.login("newGuy", "passwordOne")
+        self.create_task()
+        db.session.add(
+            Task("Feed the cat", date(2019, 1, 30), 1, date(2019, 1, 30), 1, 1)
+        )
+        db.session.commit()
+        response = self.app.get("/tasks/search?q=ban")
+        self.assertIn(b"Go to the bank", response.data)
+        self.assertNotIn(b"Feed the cat", response.data)
+        self.app.get("/complete/1")
+        response = self.app.get("/tasks/search?q=bank")
+        self.assertIn(b"Go to the bank", response.data)
+        self.assertNotIn(b"Mark as Complete", response.data)
+        self.app.get("/delete/1")
+        response = self.app.get("/tasks/search?q=bank")
+        self.assertIn(b"No tasks found.", response.data)
+
 
 if __name__ == "__main__":
     unittest.main()
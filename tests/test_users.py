@@ -11,10 +11,20 @@
   Unit tests for the user functions
 """
 
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
 import unittest
 
-from project import app, db, bcrypt
+from sqlalchemy import event
+
+from project import app, auth, db, bcrypt
+from project.imports import read_json_array
 from project.models import User
+from project.passwords import cost
 
 
 class AllTests(unittest.TestCase):
@@ -31,6 +41,9 @@ class AllTests(unittest.TestCase):
         #     basedir, TEST_DB
         # )
         app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+        # password slots of our own, not those of other runs on the host
+        self.lock_dir = app.config["PASSWORD_LOCK_DIR"]
+        app.config["PASSWORD_LOCK_DIR"] = tempfile.mkdtemp()
         self.app = app.test_client()
         db.create_all()
         self.assertEquals(app.debug, False)
@@ -39,6 +52,8 @@ class AllTests(unittest.TestCase):
     def tearDown(self):
         db.session.remove()
         db.drop_all()
+        shutil.rmtree(app.config["PASSWORD_LOCK_DIR"])
+        app.config["PASSWORD_LOCK_DIR"] = self.lock_dir
 
     #
     # Helper functions
@@ -174,6 +189,161 @@ class AllTests(unittest.TestCase):
         response = self.app.get("/tasks", follow_redirects=True)
         self.assertIn(b"newGuy", response.data)
 
+    def test_login_upgrades_hashes_made_with_another_cost(self):
+        self.create_user("newGuy", "newGuy@email.com", "passwordOne")
+        user = User.query.filter_by(name="newGuy").one()
+        self.assertEquals(cost(user.password), 12)
+        app.config["BCRYPT_LOG_ROUNDS"] = 4
+        try:
+            response = self.login("newGuy", "passwordOne")
+            self.assertIn(b"Welcome!", response.data)
+            user = User.query.filter_by(name="newGuy").one()
+            self.assertEquals(cost(user.password), 4)
+            self.logout()
+            response = self.login("newGuy", "passwordOne")
+            self.assertIn(b"Welcome!", response.data)
+        finally:
+            app.config["BCRYPT_LOG_ROUNDS"] = 12
+
+    def test_concurrent_logins_beyond_the_slots_answer_503(self):
+        tmpdir = tempfile.mkdtemp()
+        db.session.remove()
+        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(
+            tmpdir, "logins.db"
+        )
+        keys = ("PASSWORD_CONCURRENCY", "PASSWORD_WAIT", "PASSWORD_LOCK_DIR")
+        saved = {key: app.config[key] for key in keys}
+        app.config.update(
+            PASSWORD_CONCURRENCY=1,
+            PASSWORD_WAIT=0,
+            PASSWORD_LOCK_DIR=os.path.join(tmpdir, "slots"),
+        )
+        try:
+            db.create_all()
+            self.create_user("newGuy", "newGuy@email.com", "passwordOne")
+            db.session.remove()
+            logins = 4
+            barrier = threading.Barrier(logins)
+            responses = []
+
+            def login():
+                client = app.test_client()
+                barrier.wait()
+                responses.append(
+                    client.post(
+                        "/", data=dict(name="newGuy", password="passwordOne")
+                    )
+                )
+
+            threads = [threading.Thread(target=login) for _ in range(logins)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            codes = sorted(response.status_code for response in responses)
+            # one login hashes, the rest are turned away instead of queueing
+            self.assertEquals(codes[0], 302)
+            self.assertEquals(codes[-1], 503)
+            busy = [r for r in responses if r.status_code == 503]
+            self.assertEquals(busy[0].headers["Retry-After"], "1")
+        finally:
+            app.config.update(saved)
+            db.session.remove()
+            db.engine.dispose()
+            app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+            shutil.rmtree(tmpdir)
+
+    def user_queries(self, path):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            self.app.get(path)
+        finally:
+            event.remove(
+                db.engine, "before_cursor_execute", before_cursor_execute
+            )
+        return [s for s in statements if "FROM users" in s]
+
+    def test_current_user_is_loaded_once_and_then_cached(self):
+        self.create_user("newGuy", "newGuy@email.com", "passwordOne")
+        self.login("newGuy", "passwordOne")
+        auth.users.clear()
+        self.assertEquals(len(self.user_queries("/tasks")), 1)
+        self.assertEquals(len(self.user_queries("/tasks")), 0)
+
+    def test_role_changes_apply_without_logging_in_again(self):
+        self.create_user("newGuy", "newGuy@email.com", "passwordOne")
+        self.login("newGuy", "passwordOne")
+        response = self.app.get("/api/v1/cache/stats")
+        self.assertEquals(response.status_code, 403)
+        user = User.query.filter_by(name="newGuy").one()
+        user.role = "admin"
+        db.session.commit()
+        # as if AUTH_USER_CACHE_TTL had passed
+        auth.users.clear()
+        response = self.app.get("/api/v1/cache/stats")
+        self.assertEquals(response.status_code, 200)
+
+    def run_import(self, filename, content):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, filename)
+        with open(path, "w") as f:
+            f.write(content)
+        app.config["BCRYPT_LOG_ROUNDS"] = 4
+        try:
+            return app.test_cli_runner(mix_stderr=False).invoke(
+                args=["users-import", path, "--batch-size", "2"]
+            )
+        finally:
+            app.config["BCRYPT_LOG_ROUNDS"] = 12
+            shutil.rmtree(directory)
+
+    def test_users_import_reports_bad_rows_and_keeps_the_rest(self):
+        self.create_user("newGuy", "newGuy@email.com", "passwordOne")
+        result = self.run_import(
+            "users.csv",
+            "name,email,password,role\n"
+            "alice,alice@email.com,secretOne,\n"
+            "newGuy,other@email.com,secretTwo,\n"
+            "bob,bob@email.com,,\n"
+            "carol,carol@email.com,secretThree,admin\n"
+            "dave,alice@email.com,secretFour,\n",
+        )
+        self.assertIn("imported 2 users, 3 skipped", result.stdout)
+        self.assertIn("record 2: UNIQUE constraint failed", result.stderr)
+        self.assertIn("record 3: missing password", result.stderr)
+        self.assertIn("record 5: UNIQUE constraint failed", result.stderr)
+        carol = User.query.filter_by(name="carol").one()
+        self.assertEquals(carol.role, "admin")
+        self.assertEquals(cost(carol.password), 4)
+        response = self.login("alice", "secretOne")
+        self.assertIn(b"Welcome!", response.data)
+
+    def test_users_import_reads_json_lines(self):
+        result = self.run_import(
+            "users.json",
+            '{"name": "alice", "email": "a@email.com", "password": "pw1"}\n'
+            '{"name": "bob", "email": "b@email.com", "password": "pw2"}\n',
+        )
+        self.assertIn("imported 2 users, 0 skipped", result.stdout)
+        self.assertEquals(User.query.count(), 2)
+
+    def test_json_arrays_are_read_a_chunk_at_a_time(self):
+        records = [
+            {"name": f"user{i}", "email": f"{i}@email.com", "password": "pw"}
+            for i in range(20)
+        ]
+        f = io.StringIO(json.dumps(records, indent=2))
+        f.read(1)
+        self.assertEquals(list(read_json_array(f, chunk_size=7)), records)
+        f = io.StringIO('[{"name": "alice"}, {"name": ')
+        f.read(1)
+        self.assertRaises(ValueError, list, read_json_array(f, chunk_size=7))
+
 
 if __name__ == "__main__":
     unittest.main()